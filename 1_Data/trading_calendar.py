@@ -0,0 +1,142 @@
+import datetime
+
+import numpy as np
+
+# NYSE trading calendar, precomputed once into arrays.
+# Holidays are generated from the exchange rules below plus a table of
+# unscheduled closures, so the calendar works offline.
+
+START = '1990-01-01'
+END = '2040-12-31'
+
+# full-day closures that do not follow a rule
+SPECIAL_CLOSURES = [
+    '1994-04-27', # President Nixon funeral
+    '2001-09-11', '2001-09-12', '2001-09-13', '2001-09-14', # September 11
+    '2004-06-11', # President Reagan funeral
+    '2007-01-02', # President Ford funeral
+    '2012-10-29', '2012-10-30', # Hurricane Sandy
+    '2018-12-05', # President Bush funeral
+    '2025-01-09', # President Carter funeral
+]
+
+def _nth_weekday(year,month,weekday,n):
+    """ n-th weekday (0=Monday) of the month, counted from the end if n<0 """
+    if n>0:
+        d=datetime.date(year,month,1)
+        d+=datetime.timedelta((weekday-d.weekday())%7)
+        return d+datetime.timedelta(7*(n-1))
+    d=datetime.date(year+month//12,month%12+1,1)-datetime.timedelta(1)
+    d-=datetime.timedelta((d.weekday()-weekday)%7)
+    return d+datetime.timedelta(7*(n+1))
+
+def _observed(d):
+    """ Saturday holidays are observed on Friday, Sunday holidays on Monday """
+    if d.weekday()==5:
+        return d-datetime.timedelta(1)
+    if d.weekday()==6:
+        return d+datetime.timedelta(1)
+    return d
+
+def _easter(year):
+    """ Gregorian Easter Sunday """
+    a=year%19
+    b,c=divmod(year,100)
+    d,e=divmod(b,4)
+    f=(b+8)//25
+    g=(b-f+1)//3
+    h=(19*a+b-d-g+15)%30
+    i,k=divmod(c,4)
+    l=(32+2*e+2*i-h-k)%7
+    m=(a+11*h+22*l)//451
+    month,day=divmod(h+l-7*m+114,31)
+    return datetime.date(year,month,day+1)
+
+def nyse_holidays(start_year,end_year):
+    """ Full-day NYSE holidays of the years, as sorted datetime64[D] """
+    days=[]
+    for y in range(start_year,end_year+1):
+        # New Year's Day on a Saturday is not observed on the Friday before
+        ny=datetime.date(y,1,1)
+        if ny.weekday()!=5:
+            days.append(_observed(ny))
+        if y>=1998:
+            days.append(_nth_weekday(y,1,0,3)) # Martin Luther King Jr. Day
+        days.append(_nth_weekday(y,2,0,3)) # Washington's Birthday
+        days.append(_easter(y)-datetime.timedelta(2)) # Good Friday
+        days.append(_nth_weekday(y,5,0,-1)) # Memorial Day
+        if y>=2022:
+            days.append(_observed(datetime.date(y,6,19))) # Juneteenth
+        days.append(_observed(datetime.date(y,7,4))) # Independence Day
+        days.append(_nth_weekday(y,9,0,1)) # Labor Day
+        days.append(_nth_weekday(y,11,3,4)) # Thanksgiving
+        days.append(_observed(datetime.date(y,12,25))) # Christmas
+    days+=[datetime.datetime.strptime(x,'%Y-%m-%d').date() for x in SPECIAL_CLOSURES
+           if start_year<=int(x[:4])<=end_year]
+    return np.unique(np.array(days,dtype='datetime64[D]'))
+
+class TradingCalendar(object):
+    """ Session dates between start and end with O(1) lookups
+    Args:
+        start: first calendar day covered
+        end: last calendar day covered
+        holidays: closures, the NYSE holidays if None
+    """
+    def __init__(self,start=START,end=END,holidays=None):
+        self.start=np.datetime64(start,'D')
+        self.end=np.datetime64(end,'D')
+        if holidays is None:
+            holidays=nyse_holidays(self.start.astype(object).year,self.end.astype(object).year)
+        self.holidays=np.array(holidays,dtype='datetime64[D]')
+        self.busdaycal=np.busdaycalendar(weekmask='1111100',holidays=self.holidays)
+
+        days=np.arange(self.start,self.end+1,dtype='datetime64[D]')
+        isSession=np.is_busday(days,busdaycal=self.busdaycal)
+        # every session date in order
+        self.sessions=days[isSession]
+        # for every calendar day, the position of the first session on or after it
+        self._pos=np.cumsum(isSession)-isSession
+        self._isSession=isSession
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _days(self,dates):
+        d=(np.asarray(dates,dtype='datetime64[D]')-self.start).astype(np.int64)
+        if np.any(d<0) or np.any(d>=len(self._pos)):
+            raise ValueError("dates outside of calendar %s..%s" % (self.start,self.end))
+        return d
+
+    def is_session(self,dates):
+        """ True for dates that are trading sessions, scalar or array """
+        return self._isSession[self._days(dates)]
+
+    def index(self,dates):
+        """ Position of each date in sessions, non-session dates roll forward """
+        return self._pos[self._days(dates)]
+
+    def offset(self,date,n):
+        """ Session n sessions after date (before if n<0), date rolls forward """
+        return self.sessions[self.index(date)+n]
+
+    def sessions_between(self,start,end):
+        """ Sessions in the inclusive range start..end """
+        i0=self.index(start)
+        i1=self.index(end)+int(self.is_session(end))
+        return self.sessions[i0:i1]
+
+    def sessions_after(self,date,count):
+        """ The count sessions that follow date """
+        i=self.index(date)+int(self.is_session(date))
+        if i+count>len(self.sessions):
+            raise ValueError("calendar ends at %s" % self.end)
+        return self.sessions[i:i+count]
+
+_calendar=None
+
+def default_calendar():
+    """ Shared calendar, built on first use """
+    global _calendar
+    if _calendar is None:
+        _calendar=TradingCalendar()
+    return _calendar
@@ -0,0 +1,180 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from backtrader.feed import DataBase
+from backtrader import TimeFrame
+
+# Builds OHLCV bars of several intervals from one tick stream, keyed by the
+# source timestamp of the ticks. Completed bars are kept in fixed-size ring
+# buffers so memory stays flat however long the stream runs.
+
+# day number of 1970-01-01 in backtrader's date2num convention
+EPOCH_ORDINAL = 719163
+
+INTERVALS = {'1s':1,'1m':60,'5m':300,'15m':900,'1h':3600}
+UNITS = {'s':1,'m':60,'h':3600}
+
+def to_interval(x):
+    """ Seconds of an interval given in seconds or as <n>s, <n>m or <n>h """
+    if x in INTERVALS:
+        return INTERVALS[x]
+    if isinstance(x,(int,float)) and not isinstance(x,bool) and x>0:
+        return x
+    m=re.match(r'^\s*(\d+)\s*([smh])\s*$',str(x))
+    if m and int(m.group(1))>0:
+        return int(m.group(1))*UNITS[m.group(2)]
+    raise ValueError("interval %r: expected seconds, <n>s, <n>m or <n>h, e.g. %s" % (x,', '.join(INTERVALS)))
+
+def parse_intervals(value):
+    """ Intervals of an "intervals" setting, a list or a comma separated
+    string like "1m,5m", None if it is empty """
+    if not value:
+        return None
+    if isinstance(value,str):
+        value=[x for x in value.split(',') if x.strip()]
+    return [to_interval(x) for x in value] or None
+
+def to_seconds(ts):
+    """ Epoch seconds of a timestamp string, datetime or number """
+    if isinstance(ts,(int,float)):
+        return float(ts)
+    return pd.Timestamp(ts).value/1e9
+
+class RingBuffer(object):
+    """ Last size bars as rows of (dt, open, high, low, close, volume),
+    dt in backtrader day numbers. Rows keep an absolute sequence number so
+    readers can tell how far behind they are.
+    """
+    def __init__(self,size):
+        self.size=size
+        self.data=np.zeros((size,6))
+        self.count=0
+
+    def __len__(self):
+        return min(self.count,self.size)
+
+    def append(self,row):
+        self.data[self.count%self.size]=row
+        self.count+=1
+
+    def first(self):
+        """ Sequence number of the oldest bar still held """
+        return max(0,self.count-self.size)
+
+    def get(self,seq):
+        return self.data[seq%self.size]
+
+    def last(self,n):
+        """ Copy of the last n bars, oldest first """
+        n=min(n,len(self))
+        idx=np.arange(self.count-n,self.count)%self.size
+        return self.data[idx]
+
+class Subscription(object):
+    """ Reader of the completed bars of one interval """
+    def __init__(self,ring):
+        self.ring=ring
+        self.seq=ring.count
+        self.skipped=0
+
+    def next(self):
+        """ Next completed bar or None """
+        if self.seq>=self.ring.count:
+            return None
+        first=self.ring.first()
+        if self.seq<first:
+            # fell further behind than the ring holds
+            self.skipped+=first-self.seq
+            self.seq=first
+        row=self.ring.get(self.seq)
+        self.seq+=1
+        return row
+
+class BarAggregator(object):
+    """ Aggregates ticks into bars of every interval
+    Args:
+        intervals: bar lengths in seconds or names like '1m'
+        size: number of completed bars kept per interval
+    """
+    def __init__(self,intervals=(60,),size=10000):
+        self.intervals=[to_interval(x) for x in intervals]
+        self.rings={x:RingBuffer(size) for x in self.intervals}
+        # open bar per interval: [bucket, open, high, low, close, volume]
+        self.current={x:None for x in self.intervals}
+        self.ticks=0
+        self.late=0
+        self.last=None
+
+    def subscribe(self,interval):
+        return Subscription(self.rings[to_interval(interval)])
+
+    def add_tick(self,ts,price,volume=0.0):
+        t=to_seconds(ts)
+        if self.last is not None and t<self.last:
+            # bars are built in source time, late ticks are not reordered
+            self.late+=1
+            return
+        self.last=t
+        self.ticks+=1
+        for x in self.intervals:
+            bucket=t-t%x
+            b=self.current[x]
+            if b is not None and b[0]==bucket:
+                if price>b[2]:
+                    b[2]=price
+                if price<b[3]:
+                    b[3]=price
+                b[4]=price
+                b[5]+=volume
+                continue
+            if b is not None:
+                self._close(x,b)
+            self.current[x]=[bucket,price,price,price,price,volume]
+
+    def flush(self):
+        """ Complete the open bars """
+        for x in self.intervals:
+            if self.current[x] is not None:
+                self._close(x,self.current[x])
+                self.current[x]=None
+
+    def _close(self,x,b):
+        # stamped with the end of the bar, like backtrader's resampler
+        dt=(b[0]+x)/86400.0+EPOCH_ORDINAL
+        self.rings[x].append((dt,b[1],b[2],b[3],b[4],b[5]))
+
+class AlgoBarData(DataBase):
+    """ Bars of one interval of the aggregator of an AlgoLiveData feed,
+    so a strategy can use several intervals of one tick stream
+    """
+    def __init__(self,source,interval):
+        super(AlgoBarData, self).__init__()
+        self.source=source
+        self.interval=to_interval(interval)
+        self.subscription=source.aggregator.subscribe(self.interval)
+        self.p.timeframe=TimeFrame.Seconds
+        self.p.compression=self.interval
+
+    def islive(self):
+        return True
+
+    def haslivedata(self):
+        return self.source.connected
+
+    def _load(self):
+        # the source feed pulls the ticks, this one only reads its bars
+        row=self.subscription.next()
+        if row is None:
+            return None
+        set_bar(self.lines,row)
+        return True
+
+def set_bar(lines,row):
+    lines.datetime[0] = row[0]
+    lines.open[0] = row[1]
+    lines.high[0] = row[2]
+    lines.low[0] = row[3]
+    lines.close[0] = row[4]
+    lines.volume[0] = row[5]
@@ -0,0 +1,283 @@
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from backtrader.feed import DataBase
+from backtrader import TimeFrame
+import backtrader as bt
+
+import numpy as np
+
+from algo_columnar_feed import EPOCH_ORDINAL
+
+# Out-of-core intraday bars: a series is written in chunks of columns and
+# the feed reads one chunk at a time, so memory does not grow with the
+# length of the series. Run with "exactbars": "1" so backtrader keeps only
+# the bars the indicators need, and "equity_points" to bound the equity
+# curve kept for the chart and the results store.
+#
+#   <path>/index.json           {"columns":[...],"chunks":[{"count","start","end"}]}
+#   <path>/<n>/<column>.npy     float64, dt holds backtrader day numbers
+#
+# Columns other than dt,open,high,low,close,volume become lines of the
+# feed, e.g. self.data.vwap[0].
+#
+#   python algo_chunked_feed.py bench [bars ...]
+
+BASE_COLUMNS = ['dt','open','high','low','close','volume']
+
+def to_daynum(values):
+    """ Backtrader day numbers of datetime64 values or datetimes """
+    us=np.asarray(values).astype('datetime64[us]').astype(np.int64)
+    return us/86400e6+EPOCH_ORDINAL
+
+def write_chunks(chunks,path):
+    """ Write a series given as an iterable of column dicts, one chunk each
+    Args:
+        chunks: {column: array}, dt as datetime64 or backtrader day numbers
+        path: store directory
+    Returns:
+        index
+    """
+    os.makedirs(path,exist_ok=True)
+    index={'columns':None,'chunks':[]}
+    t=time.time()
+    for chunk in chunks:
+        cols=dict(chunk)
+        if 'dt' not in cols or not len(cols['dt']):
+            continue
+        if not np.issubdtype(np.asarray(cols['dt']).dtype,np.floating):
+            cols['dt']=to_daynum(cols['dt'])
+        if index['columns'] is None:
+            index['columns']=BASE_COLUMNS+sorted(x for x in cols if x not in BASE_COLUMNS)
+        d=os.path.join(path,str(len(index['chunks'])))
+        os.makedirs(d,exist_ok=True)
+        for x in index['columns']:
+            np.save(os.path.join(d,x+'.npy'),np.ascontiguousarray(cols[x],dtype=np.float64))
+        index['chunks'].append({'count':len(cols['dt']),'start':float(cols['dt'][0]),'end':float(cols['dt'][-1])})
+    with open(os.path.join(path,'index.json'), 'w') as f:
+        f.write(json.dumps(index))
+    print("[CHUNKS] %s bars in %s chunks written in %.2fs" % (sum(x['count'] for x in index['chunks']),len(index['chunks']),time.time()-t))
+    return index
+
+def csv_chunks(datafile,rows=100000,dt='dt'):
+    """ Column dicts of a csv read rows at a time """
+    import pandas as pd
+    for df in pd.read_csv(datafile,chunksize=rows,parse_dates=[dt]):
+        cols={x:df[x].values for x in df.columns if x!=dt and df[x].dtype.kind in 'fiu'}
+        cols['dt']=df[dt].values
+        yield cols
+
+def row_chunks(rows,columns,size=100000):
+    """ Column dicts of an iterator of rows, e.g. Spark's toLocalIterator(),
+    without materializing the rows
+    Args:
+        rows: iterable of dicts or Rows
+        columns: {column: row field}, 'dt' among them
+        size: rows per chunk
+    """
+    buf={x:[] for x in columns}
+    for r in rows:
+        for x,field in columns.items():
+            buf[x].append(r[field])
+        if len(buf['dt'])>=size:
+            yield {x:np.array(v,dtype='datetime64[us]' if x=='dt' else np.float64) for x,v in buf.items()}
+            buf={x:[] for x in columns}
+    if buf['dt']:
+        yield {x:np.array(v,dtype='datetime64[us]' if x=='dt' else np.float64) for x,v in buf.items()}
+
+def read_index(path):
+    with open(os.path.join(path,'index.json'), 'r') as f:
+        return json.load(f)
+
+class AlgoChunkedData(DataBase):
+    """ Bars of a chunked store, one chunk in memory at a time; use
+    chunked_data() to get the extra columns as lines """
+    params=(('timeframe',TimeFrame.Minutes),('compression',1))
+
+    def __init__(self,path):
+        super(AlgoChunkedData, self).__init__()
+        self.path=path
+        self.index=read_index(path)
+        self.count=sum(x['count'] for x in self.index['chunks'])
+        self.extra=[x for x in self.index['columns'] if x not in BASE_COLUMNS]
+        print("ChunkedData:count=%s,chunks=%s,extra=%s" % (self.count,len(self.index['chunks']),self.extra))
+
+    def start(self):
+        super(AlgoChunkedData, self).start()
+        self.chunk=-1
+        self.n=0
+        self.cols=None
+
+    def _next_chunk(self):
+        # the previous chunk is dropped before the next one is read, so only
+        # one is ever held
+        self.cols=None
+        self.chunk+=1
+        if self.chunk>=len(self.index['chunks']):
+            return False
+        d=os.path.join(self.path,str(self.chunk))
+        # read, not memory-mapped: the pages of the previous chunk are freed
+        # with it instead of staying resident
+        self.cols={x:np.load(os.path.join(d,x+'.npy')).tolist() for x in self.index['columns']}
+        self.n=0
+        return True
+
+    def _load(self):
+        if self.cols is None or self.n>=len(self.cols['dt']):
+            if not self._next_chunk():
+                return False
+        n=self.n
+        c=self.cols
+        self.lines.datetime[0] = c['dt'][n]
+        self.lines.open[0] = c['open'][n]
+        self.lines.high[0] = c['high'][n]
+        self.lines.low[0] = c['low'][n]
+        self.lines.close[0] = c['close'][n]
+        self.lines.volume[0] = c['volume'][n]
+        self.lines.openinterest[0] = 0
+        for x in self.extra:
+            getattr(self.lines,x)[0] = c[x][n]
+        self.n=n+1
+        return True
+
+def chunked_data(path,**kwargs):
+    """ AlgoChunkedData with a line for every extra column of the store """
+    extra=tuple(x for x in read_index(path)['columns'] if x not in BASE_COLUMNS)
+    cls=AlgoChunkedData
+    if extra:
+        cls=type('AlgoChunkedData_'+'_'.join(extra),(AlgoChunkedData,),{'lines':extra})
+    return cls(path,**kwargs)
+
+def peak_rss_mb():
+    """ Peak resident memory of this process """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+def synthetic_chunks(count,size=100000,seed=0):
+    """ count one-minute bars of a random walk, 390 per weekday session,
+    with a vwap column, generated chunk by chunk """
+    rng=np.random.RandomState(seed)
+    price=100.0
+    day=np.datetime64('2010-01-04','D')
+    minute=0
+    done=0
+    while done<count:
+        n=min(size,count-done)
+        # session minutes of the chunk, skipping weekends
+        mins=np.arange(minute,minute+n)
+        days=mins//390
+        dates=np.busday_offset(day,days,roll='forward')
+        dt=dates.astype('datetime64[m]')+np.timedelta64(570,'m')+(mins%390).astype('timedelta64[m]')
+        close=price*np.exp(np.cumsum(rng.normal(0,0.0008,n)))
+        open_=np.concatenate([[price],close[:-1]])
+        price=close[-1]
+        yield {'dt':dt,'open':open_,'high':np.maximum(open_,close)*1.0002,'low':np.minimum(open_,close)*0.9998,
+               'close':close,'volume':rng.randint(100,10000,n).astype(np.float64),'vwap':(open_+close)/2.0}
+        minute+=n
+        done+=n
+
+class ChunkedEMA(bt.Strategy):
+    """ EMA crossover on minute bars, used by the benchmark """
+    config=None
+
+    def __init__(self):
+        self.config=dict(type(self).config)
+        self.fast=bt.ind.ExponentialMovingAverage(period=int(self.config.get('fast_period',20)))
+        self.slow=bt.ind.ExponentialMovingAverage(period=int(self.config.get('slow_period',100)))
+
+    @staticmethod
+    def init_broker(broker):
+        broker.setcash(100000.0)
+        broker.setcommission(commission=0.0)
+
+    def next(self):
+        if not self.position:
+            if self.fast[0]>self.slow[0]:
+                self.buy(size=100)
+            else:
+                self.sell(size=100)
+        elif self.position.size>0 and self.fast[0]<self.slow[0]:
+            self.sell(size=200)
+        elif self.position.size<0 and self.fast[0]>self.slow[0]:
+            self.buy(size=200)
+
+def _measure(path,mode):
+    """ One run in this process, prints its result as JSON """
+    from algo_base import AlgoStrategy
+    from algo_columnar_feed import AlgoColumnarData
+    config={'chart':'false','fast_period':20,'slow_period':100}
+    if mode=='out_of_core':
+        config['exactbars']=1
+        data=chunked_data(path)
+    else:
+        # the whole series in memory and every line value kept, as before
+        index=read_index(path)
+        cols={}
+        for i in range(len(index['chunks'])):
+            for x in BASE_COLUMNS:
+                cols.setdefault(x,[]).append(np.load(os.path.join(path,str(i),x+'.npy')))
+        cols={x:np.concatenate(v) for x,v in cols.items()}
+        cols['vol']=cols.pop('volume')
+        data=AlgoColumnarData(None,'data',columns=cols)
+        data.p.timeframe=TimeFrame.Minutes
+    stdout=sys.stdout
+    sys.stdout=open(os.devnull, 'w')
+    t=time.time()
+    algo=AlgoStrategy(config,ChunkedEMA,data)
+    algo.run()
+    elapsed=time.time()-t
+    m=algo.metrics()
+    sys.stdout=stdout
+    print(json.dumps({'mode':mode,'bars':sum(x['count'] for x in read_index(path)['chunks']),
+                      'equity_points':len(algo.thestrat.analyzers.equity.get_analysis()['value']),'seconds':elapsed,'rss_mb':peak_rss_mb(),'pnl':m['pnl'],'trades':m['trades']}))
+
+# peak RSS growth of out-of-core runs from the shortest to the longest
+# series that still counts as flat; the shortest default series is one
+# chunk, so holding two chunks at once shows as growth
+RSS_TOLERANCE = 0.1
+
+def benchmark(counts=(100000,1000000),modes=('out_of_core','in_memory')):
+    """ Peak RSS and bars/s of a minute-bar EMA run per series length and
+    mode, every run in a fresh process so the peaks are its own
+    Returns:
+        results: one dict per run
+        flat: True if the out-of-core peak RSS does not grow with the series
+    """
+    res=[]
+    for count in counts:
+        path=tempfile.mkdtemp(prefix='chunks')
+        try:
+            write_chunks(synthetic_chunks(count),path)
+            for mode in modes:
+                p=subprocess.run([sys.executable,os.path.abspath(__file__),'measure',path,mode],
+                                 stdout=subprocess.PIPE,universal_newlines=True,cwd=os.path.dirname(os.path.abspath(__file__)))
+                lines=[x for x in p.stdout.splitlines() if x.startswith('{')]
+                if not lines:
+                    print("[BENCH] %s bars %s failed" % (count,mode))
+                    continue
+                r=json.loads(lines[-1])
+                res.append(r)
+                print("[BENCH] %8s bars %-12s peak RSS %7.1f MB, %.1fs (%.0f bars/s), pnl %.2f, %s trades" %
+                      (count,mode,r['rss_mb'],r['seconds'],count/r['seconds'],r['pnl'],r['trades']))
+        finally:
+            shutil.rmtree(path,ignore_errors=True)
+    rss=[(r['bars'],r['rss_mb']) for r in res if r['mode']=='out_of_core']
+    flat=True
+    if len(rss)>1:
+        (n0,lo),(n1,hi)=min(rss),max(rss)
+        flat=hi<=lo*(1+RSS_TOLERANCE)
+        print("[BENCH] out_of_core peak RSS %s: %.1f MB at %s bars, %.1f MB at %s bars" %
+              ('flat' if flat else 'GROWS',lo,n0,hi,n1))
+    return res,flat
+
+if __name__ == '__main__':
+    if len(sys.argv)>1 and sys.argv[1]=='measure':
+        _measure(sys.argv[2],sys.argv[3])
+    elif len(sys.argv)>1 and sys.argv[1]=='bench':
+        res,flat=benchmark([int(x) for x in sys.argv[2:]] or (100000,1000000))
+        sys.exit(0 if flat else 1)
@@ -0,0 +1,195 @@
+import json
+import os
+import time
+
+import numpy as np
+
+# Inference of Keras Sequential models made of Dense layers (the
+# long/short forecast network of Strategy_ML_Forecast) with numpy, from the
+# weights of the .h5 file. Importing h5py takes a fraction of the time of
+# TensorFlow, and one prediction per bar is a few matrix products instead of
+# a Keras predict call.
+#
+# The numpy network is only used when its predictions match the Keras
+# outputs saved next to the model (model_reference.json for model.h5), which
+# are checked at every load; without them, or if they differ, and for other
+# models, the model is loaded with Keras.
+#
+#   python algo_dense_model.py model_long_short_predict.h5
+#   python algo_dense_model.py model_long_short_predict.h5 reference   (needs Keras)
+
+# largest difference to the Keras outputs that counts as the same
+TOLERANCE = 1e-5
+
+def _sigmoid(x):
+    return 1.0/(1.0+np.exp(-x))
+
+def _softmax(x):
+    e=np.exp(x-np.max(x,axis=-1,keepdims=True))
+    return e/np.sum(e,axis=-1,keepdims=True)
+
+ACTIVATIONS = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x,0),
+    'sigmoid': _sigmoid,
+    'tanh': np.tanh,
+    'softmax': _softmax,
+}
+
+# layers without weights that do nothing at inference
+PASSTHROUGH = ['Dropout','InputLayer','GaussianNoise','GaussianDropout','AlphaDropout']
+
+class DenseModel(object):
+    """ Stack of dense layers
+    Args:
+        layers: list of (kernel, bias, activation name)
+    """
+    def __init__(self,layers):
+        self.layers=[(k,b,ACTIVATIONS[a]) for k,b,a in layers]
+
+    def predict(self,x):
+        """ Outputs of a batch of inputs, float32 like Keras """
+        x=np.asarray(x,dtype=np.float32)
+        for k,b,activation in self.layers:
+            x=x.dot(k)
+            if b is not None:
+                x+=b
+            x=activation(x)
+        return x
+
+def _text(x):
+    return x.decode('utf-8') if isinstance(x,bytes) else x
+
+def read_dense_model(path):
+    """ DenseModel of a Keras .h5 file, None if it has other layers """
+    import h5py
+    with h5py.File(path,'r') as f:
+        if 'model_config' not in f.attrs:
+            return None
+        config=json.loads(_text(f.attrs['model_config']))
+        if config['class_name']!='Sequential':
+            return None
+        layers=config['config']
+        if isinstance(layers,dict):
+            layers=layers['layers']
+        weights=f['model_weights'] if 'model_weights' in f else f
+        res=[]
+        for layer in layers:
+            name=layer['class_name']
+            if name in PASSTHROUGH:
+                continue
+            c=layer['config']
+            if name=='Activation' and c['activation'] in ACTIVATIONS and res:
+                k,b,a=res[-1]
+                if a!='linear':
+                    return None
+                res[-1]=(k,b,c['activation'])
+                continue
+            if name!='Dense' or c.get('activation','linear') not in ACTIVATIONS:
+                return None
+            g=weights[c['name']]
+            values={_text(x).split('/')[-1].split(':')[0]:np.array(g[_text(x)],dtype=np.float32)
+                    for x in g.attrs['weight_names']}
+            res.append((values['kernel'],values.get('bias'),c.get('activation','linear')))
+    return DenseModel(res)
+
+def reference_path(path):
+    return os.path.splitext(path)[0]+'_reference.json'
+
+def reference_inputs(n,count=64,seed=0):
+    """ Inputs like the ones of the forecast strategy, min-max scaled prices
+    and rates of change in percent, plus all zeros and all ones """
+    rng=np.random.RandomState(seed)
+    x=rng.normal(scale=5.0,size=(count,n))
+    x[:,:n//2+1]=rng.uniform(size=(count,n//2+1))
+    x[0]=0.0
+    x[1]=1.0
+    return x.astype(np.float32)
+
+def write_reference(path,count=64,seed=0):
+    """ Save fixed inputs and their Keras predictions next to the model """
+    from keras.models import load_model as keras_load_model
+    import keras
+    model=keras_load_model(path)
+    x=reference_inputs(model.input_shape[-1],count,seed)
+    y=model.predict(x)
+    out=reference_path(path)
+    with open(out,'w') as f:
+        json.dump({'model':os.path.basename(path),'keras_version':keras.__version__,
+                   'inputs':x.tolist(),'outputs':y.tolist()},f)
+    print("[PARITY] %s: %s Keras %s predictions" % (out,count,keras.__version__))
+    return out
+
+def check_reference(model,path):
+    """ Max difference of the predictions to the saved Keras outputs, None
+    if there are none """
+    ref=reference_path(path)
+    if not os.path.exists(ref):
+        return None
+    with open(ref,'r') as f:
+        d=json.load(f)
+    x=np.array(d['inputs'],dtype=np.float32)
+    if x.shape[-1]!=model.layers[0][0].shape[0]:
+        return float('inf')
+    return float(np.max(np.abs(model.predict(x)-np.array(d['outputs'],dtype=np.float32))))
+
+def load_model(path):
+    """ DenseModel of the file if it matches the Keras outputs saved with
+    it, else the Keras model """
+    model=read_dense_model(path)
+    if model is None:
+        print("[MODEL] %s is not a dense network, loading it with Keras" % path)
+    else:
+        diff=check_reference(model,path)
+        if diff is None:
+            print("[MODEL] no Keras outputs in %s, loading %s with Keras" % (reference_path(path),path))
+            model=None
+        elif diff>TOLERANCE:
+            print("[MODEL] %s differs from its Keras outputs by %.2e, loading it with Keras" % (path,diff))
+            model=None
+    if model is None:
+        from keras.models import load_model as keras_load_model
+        model=keras_load_model(path)
+    return model
+
+def parity(path,count=1000,seed=0):
+    """ Compare the predictions with the saved Keras outputs and, when Keras
+    is installed, with Keras on count more inputs
+    Returns:
+        ok: True if they agree within TOLERANCE
+    """
+    model=read_dense_model(path)
+    diff=check_reference(model,path)
+    ok=diff is not None and diff<=TOLERANCE
+    if diff is None:
+        print("[PARITY] %s: no saved Keras outputs in %s" % (path,reference_path(path)))
+    else:
+        print("[PARITY] %s: max difference %.2e to the saved Keras outputs" % (path,diff))
+    try:
+        from keras.models import load_model as keras_load_model
+    except ImportError:
+        print("[PARITY] keras is not installed, live comparison skipped")
+        return ok
+    x=np.random.RandomState(seed).normal(size=(count,model.layers[0][0].shape[0]))
+    diff=float(np.max(np.abs(model.predict(x)-keras_load_model(path).predict(x))))
+    print("[PARITY] %s: max difference %.2e to Keras over %s inputs" % (path,diff,count))
+    return ok and diff<=TOLERANCE
+
+def benchmark(path,count=1000):
+    """ Load time and time of count single-row predictions """
+    t=time.time()
+    model=read_dense_model(path)
+    load=time.time()-t
+    x=np.random.RandomState(0).normal(size=(1,model.layers[0][0].shape[0]))
+    t=time.time()
+    for _ in range(count):
+        model.predict(x)
+    print("[BENCH] %s: loaded in %.1fms, %.1fus per prediction" % (path,load*1000,(time.time()-t)/count*1e6))
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv)>2 and sys.argv[2]=='reference':
+        write_reference(sys.argv[1])
+    else:
+        benchmark(sys.argv[1])
+        sys.exit(0 if parity(sys.argv[1]) else 1)
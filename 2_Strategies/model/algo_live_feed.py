@@ -11,14 +11,30 @@ import numpy as np
 import pandas as pd
 import json
 import boto3
+import queue
+import random
+import threading
+from collections import deque
+
+from algo_bar_aggregator import AlgoBarData, BarAggregator, set_bar
 
 class AlgoLiveData(DataBase):
-    def __init__(self,region):
+    def __init__(self,region,prefetch=False,queue_size=1000,poll_interval=1.0,max_backoff=60.0,client=None,
+                 intervals=None,ring_size=10000):
         super(AlgoLiveData, self).__init__()
         self.region=region
-        self.lambda_client = boto3.client('lambda',region_name=self.region)
+        if client is None:
+            client = boto3.client('lambda',region_name=self.region)
+        self.lambda_client = client
         self.connected=False
 
+        # cursor: key of the newest bar seen, only newer bars are requested
+        # and delivered, one per _load; ticks can share a timestamp, so in
+        # aggregation mode cursor_ticks counts those delivered at the cursor
+        self.cursor=None
+        self.cursor_ticks=0
+        self.pending=deque()
+
         #start_date = '2017-08-11'
         #now = datetime.datetime.now() # current date and time
         #end_date = now.strftime("%Y-%m-%d")
@@ -27,13 +43,47 @@ class AlgoLiveData(DataBase):
         #self.todate=pd.to_datetime(end_date, format = "%Y-%m-%d")
         self.timeframe=bt.TimeFrame.Ticks
         print(self.lines.datetime.array)
+
+        # prefetch mode: a background thread polls the market data into a
+        # bounded queue and _load only dequeues bars that are ready
+        self.prefetch=prefetch
+        self.poll_interval=poll_interval
+        self.max_backoff=max_backoff
+        self.failures=0
+        self.queue=queue.Queue(maxsize=queue_size)
+        self._stopped=threading.Event()
+        self._thread=None
+        self.stats={'fetches':0,'errors':0,'bars':0,'duplicates':0,
+                    'fetch_latency':0.0,'fetch_time':0.0,'staleness':0.0}
+
+        # aggregation mode: the source sends ticks, which are built into bars
+        # of every interval keyed by their own timestamp; this feed serves the
+        # first interval, bars(interval) returns a feed for the others
+        self.aggregator=None
+        if intervals:
+            self.aggregator=BarAggregator(intervals,ring_size)
+            self.interval=self.aggregator.intervals[0]
+            self.subscription=self.aggregator.subscribe(self.interval)
+            self.p.timeframe=TimeFrame.Seconds
+            self.p.compression=self.interval
  
     def start(self):
+        # the base start sets the status cerebro reads once several feeds run
+        super(AlgoLiveData, self).start()
         print("start feed")
         print(self.lines.datetime.array)
+        if self.prefetch and self._thread is None:
+            self._stopped.clear()
+            self._thread=threading.Thread(target=self._poll,name='AlgoLiveData')
+            self._thread.daemon=True
+            self._thread.start()
     
     def stop(self):
         print("stop feed")
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread=None
     
     def islive(self):
         '''Returns ``True`` to notify ``Cerebro`` that preloading and runonce
@@ -45,15 +95,183 @@ class AlgoLiveData(DataBase):
         should be deactivated'''
         return self.connected
 
+    def counters(self):
+        """Queue depth, fetch latency and staleness of the last dequeued bar"""
+        c=dict(self.stats)
+        c['queue_depth']=self.queue.qsize()
+        c['fetch_latency_avg']=c['fetch_time']/c['fetches'] if c['fetches'] else 0.0
+        if self.aggregator is not None:
+            c['ticks']=self.aggregator.ticks
+            c['late_ticks']=self.aggregator.late
+        return c
+
+    def backoff(self,failures):
+        """Exponential backoff with full jitter after failures polls in a row
+        that failed or brought nothing"""
+        return random.uniform(0,min(self.max_backoff,self.poll_interval*2**failures))
+
+    def bars(self,interval):
+        """Feed of the bars of another interval of the same tick stream"""
+        return AlgoBarData(self,interval)
+
+    def ingest(self,timeout=None):
+        """Move the ticks received so far into the aggregator, in prefetch
+        mode waiting up to timeout seconds for the first one"""
+        if self.prefetch:
+            while True:
+                try:
+                    if timeout:
+                        fetched,x=self.queue.get(timeout=timeout)
+                        timeout=None
+                    else:
+                        fetched,x=self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                self.stats['staleness']=time.time()-fetched
+                self._add_tick(x)
+            return
+        if not self.pending:
+            self.pull()
+        while self.pending:
+            self._add_tick(self.pending.popleft())
+
+    def _add_tick(self,x):
+        price=x['price'] if 'price' in x else x['close']
+        self.aggregator.add_tick(x['date'],float(price),float(x.get('volume',0)))
+
     def _load(self):
         #print("A:%s" % self.lines.datetime.array)
+        if self.aggregator is not None:
+            self.ingest()
+            row=self.subscription.next()
+            if row is None:
+                # wait for more ticks instead of spinning, cerebro calls
+                # _load again as soon as None is returned
+                if self.prefetch:
+                    self.ingest(self.poll_interval)
+                else:
+                    time.sleep(self.poll_interval)
+                return None
+            set_bar(self.lines,row)
+            self.connected=True
+            self._laststatus=self.LIVE
+            return True
+        if self.prefetch:
+            try:
+                fetched,x=self.queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                # live feed: no bar yet, but not finished either
+                return None
+            self.stats['staleness']=time.time()-fetched
+            self._set_bar(x)
+            return True
         if not self.connected:
+            empty=0
             while not self.connected:
                 self.pull()
-        else:
+                if not self.connected and not self.failures:
+                    # no bars yet: back off instead of polling in a loop,
+                    # pull backs off itself after errors
+                    empty+=1
+                    time.sleep(self.backoff(empty))
+        elif not self.pending:
             self.pull()
+        if not self.pending:
+            time.sleep(self.poll_interval)
+            return None
+        self._set_bar(self.pending.popleft())
         return True
 
+    @staticmethod
+    def bar_key(x):
+        """Sequence number of a bar if the source sends one, else its timestamp"""
+        if 'seq' in x:
+            return int(x['seq'])
+        return pd.to_datetime(x['date'])
+
+    def fetch(self):
+        """Bars newer than the cursor, replays and older bars are dropped"""
+        t=time.time()
+        # ticks without a seq are told apart by their position among the
+        # ticks of the same timestamp, so those are requested again
+        ticks=self.aggregator is not None and isinstance(self.cursor,pd.Timestamp)
+        item={}
+        if self.cursor is not None:
+            if isinstance(self.cursor,int):
+                item['since']=self.cursor
+            elif ticks:
+                item['since']=(self.cursor-pd.Timedelta(microseconds=1)).isoformat()
+            else:
+                item['since']=self.cursor.isoformat()
+        res=self.lambda_client.invoke(
+            FunctionName='algo_market_data',
+            InvocationType='RequestResponse',
+            Payload=json.dumps(item)
+        )
+        l=json.loads(res['Payload'].read().decode('utf-8'))
+        latency=time.time()-t
+        self.stats['fetches']+=1
+        self.stats['fetch_latency']=latency
+        self.stats['fetch_time']+=latency
+
+        bars=[]
+        same=0 # ticks at the cursor timestamp in this response
+        for x in l:
+            k=self.bar_key(x)
+            if self.cursor is not None and k<=self.cursor:
+                if self.aggregator is not None and k==self.cursor and not isinstance(k,int):
+                    same+=1
+                    if same>self.cursor_ticks:
+                        self.cursor_ticks+=1
+                        bars.append(x)
+                        continue
+                self.stats['duplicates']+=1
+                continue
+            self.cursor=k
+            self.cursor_ticks=same=1
+            bars.append(x)
+        return bars
+
+    def _set_bar(self,x):
+        close=x['close']
+
+        # stamped with the source timestamp, not the time it arrived
+        self.lines.datetime[0] = date2num(pd.to_datetime(x['date']).to_pydatetime())
+        self.lines.open[0] = close
+        self.lines.high[0] = close
+        self.lines.low[0] = close
+        self.lines.close[0] = close
+        self.lines.volume[0] = 0
+
+        self.connected=True
+        self._laststatus=self.LIVE
+
+    def _poll(self):
+        failures=0
+        while not self._stopped.is_set():
+            try:
+                l=self.fetch()
+            except Exception as e:
+                failures+=1
+                self.stats['errors']+=1
+                delay=self.backoff(failures)
+                print("err:%s,retry in %.2fs" % (e,delay))
+                self._stopped.wait(delay)
+                continue
+            failures=0
+
+            fetched=time.time()
+            for x in l:
+                # blocks while the queue is full, the strategy sets the pace
+                while not self._stopped.is_set():
+                    try:
+                        self.queue.put((fetched,x),timeout=1.0)
+                        self.stats['bars']+=1
+                        break
+                    except queue.Full:
+                        pass
+            self._stopped.wait(self.poll_interval)
+
     def pull(self):
         #print("B:%s" % self.lines.datetime.array)
         if math.isnan(self.lines.datetime[0]):
@@ -61,34 +279,19 @@ class AlgoLiveData(DataBase):
             self.lines.datetime[0]=date2num(now)
         now=datetime.datetime.now()
         try:
-            item={}
-            res=self.lambda_client.invoke(
-                FunctionName='algo_market_data',
-                InvocationType='RequestResponse',
-                Payload=json.dumps(item)
-            )
-            t=res['Payload']
-            l=json.loads(t.read().decode('utf-8'))
+            l=self.fetch()
             print("load:%s" % l)
             
             #print(self.lines.datetime.array)
             #print(self.lines.close.array)
             
-            for x in l:
-                dt=pd.to_datetime(x['date'], format = "%Y-%m-%d")
-                #print(dt)
-                close=x['close']
-                
-                self.lines.datetime[0] = date2num(datetime.datetime.now())
-                self.lines.open[0] = close
-                self.lines.high[0] = close
-                self.lines.low[0] = close
-                self.lines.close[0] = close
-                self.lines.volume[0] = 0
-                
+            self.pending.extend(l)
+            if l:
                 self.connected=True
-                self._laststatus=self.LIVE
-                #print("connected")
+            self.failures=0
         except Exception as e:
-            print("err:%s" % e)
-            time.sleep(5)
\ No newline at end of file
+            self.failures+=1
+            self.stats['errors']+=1
+            delay=self.backoff(self.failures)
+            print("err:%s,retry in %.2fs" % (e,delay))
+            time.sleep(delay)
\ No newline at end of file
@@ -0,0 +1,251 @@
+import contextlib
+import datetime
+import math
+import os
+import time
+
+import backtrader as bt
+from backtrader import date2num, num2date
+
+# Performance metrics of a run kept up to date bar by bar and trade by
+# trade, in constant time and memory: drawdown, yearly Sharpe ratio, SQN,
+# strike rate, streaks and PnL. They follow the definitions of backtrader's
+# DrawDown, SharpeRatio_A, SQN and TradeAnalyzer, with running moments
+# instead of the lists of returns and trade PnLs, and can be read at any
+# time with get_analysis(), also while a live run goes on.
+#
+# "metrics_every": "60" prints them every 60 bars, which serve does by default.
+#
+#   python algo_online.py data.csv parity
+#   python algo_online.py data.csv bench
+
+RISK_FREE_RATE = 0.01 # SharpeRatio_A default, yearly returns
+
+class RunningStats(object):
+    """ Count, sum, mean and population variance of a stream of values
+    (Welford's algorithm) """
+    __slots__=('n','total','mean','m2')
+
+    def __init__(self):
+        self.n=0
+        self.total=0.0
+        self.mean=0.0
+        self.m2=0.0
+
+    def add(self,x):
+        self.n+=1
+        self.total+=x
+        delta=x-self.mean
+        self.mean+=delta/self.n
+        self.m2+=delta*(x-self.mean)
+
+    def std(self):
+        return math.sqrt(self.m2/self.n) if self.n else 0.0
+
+    def with_value(self,x):
+        """ Copy with one more value, to include a period still open """
+        s=RunningStats()
+        s.n,s.total,s.mean,s.m2=self.n,self.total,self.mean,self.m2
+        s.add(x)
+        return s
+
+def sqn(stats):
+    """ SQN of the trade PnLs, as backtrader: 0 under two trades, None if
+    they are all equal """
+    if stats.n<2:
+        return 0
+    std=stats.std()
+    if not std:
+        return None
+    return math.sqrt(stats.n)*stats.mean/std
+
+class OnlineMetrics(bt.Analyzer):
+    """ Drawdown, yearly Sharpe ratio, SQN, strike rate, streaks and PnL of
+    the broker value and the closed trades, updated at every bar and trade """
+    params=(('riskfreerate',RISK_FREE_RATE),('every',0))
+
+    def start(self):
+        broker=self.strategy.broker
+        self.fundmode=broker.fundmode
+        self.start_value=broker.fundvalue if self.fundmode else broker.getvalue()
+        self.value=self.last_value=self.start_value
+        self.bars=0
+        # drawdown
+        self.peak=float('-inf')
+        self.drawdown=0.0
+        self.max_drawdown=0.0
+        self.max_moneydown=0.0
+        # returns of the finished years minus the risk free rate, the year
+        # in progress is added when read
+        self.returns=RunningStats()
+        self.year_end=float('-inf')
+        self.year_start_value=None
+        # trades
+        self.pnls=RunningStats()
+        self.won=0
+        self.open=0
+        self.streak=0 # >0 winning, <0 losing
+        self.longest_won=0
+        self.longest_lost=0
+        self.t=time.time()
+
+    def notify_fund(self, cash, value, fundvalue, shares):
+        self.value=fundvalue if self.fundmode else value
+
+    def notify_trade(self, trade):
+        if trade.justopened:
+            self.open+=1
+        elif trade.status==trade.Closed:
+            self.open-=1
+            pnl=trade.pnlcomm
+            self.pnls.add(pnl)
+            if pnl>=0.0:
+                self.won+=1
+                self.streak=self.streak+1 if self.streak>0 else 1
+                self.longest_won=max(self.longest_won,self.streak)
+            else:
+                self.streak=self.streak-1 if self.streak<0 else -1
+                self.longest_lost=max(self.longest_lost,-self.streak)
+
+    def next(self):
+        dt=self.strategy.datetime[0]
+        if dt>=self.year_end:
+            # a new year: the return of the last one is final
+            if self.year_start_value is not None:
+                self.returns.add(self.last_value/self.year_start_value-1.0-self.p.riskfreerate)
+            self.year_start_value=self.last_value
+            self.year_end=date2num(datetime.datetime(num2date(dt).year+1,1,1))
+        value=self.value
+        if value>self.peak:
+            self.peak=value
+        moneydown=self.peak-value
+        self.drawdown=100.0*moneydown/self.peak
+        if moneydown>self.max_moneydown:
+            self.max_moneydown=moneydown
+        if self.drawdown>self.max_drawdown:
+            self.max_drawdown=self.drawdown
+        self.last_value=value
+        self.bars+=1
+        if self.p.every and self.bars%self.p.every==0:
+            self.report()
+
+    def sharpe_ratio(self):
+        """ Sharpe ratio of the yearly returns, the current year included,
+        None like SharpeRatio_A when it is undefined """
+        if self.year_start_value is None:
+            return None
+        r=self.returns.with_value(self.last_value/self.year_start_value-1.0-self.p.riskfreerate)
+        std=r.std()
+        if not std:
+            return None
+        return r.mean/std
+
+    def get_analysis(self):
+        n=self.pnls.n
+        return {'trades': n,
+                'won': self.won,
+                'lost': n-self.won,
+                'open': self.open,
+                'strike_rate': 100.0*self.won/n if n else 0,
+                'longest_won': self.longest_won,
+                'longest_lost': self.longest_lost,
+                'net': self.pnls.total,
+                'max_drawdown': self.max_drawdown,
+                'max_moneydown': self.max_moneydown,
+                'drawdown': self.drawdown,
+                'pnl': self.last_value-self.start_value,
+                'sqn': sqn(self.pnls),
+                'sharpe_ratio': self.sharpe_ratio(),
+                'bars': self.bars}
+
+    def report(self):
+        m=self.get_analysis()
+        print("[METRICS] %s %s bars in %.0fs: pnl %.2f, trades %s, strike rate %.2f%%, drawdown %.2f%% (max %.2f%%), sqn %.2f, sharpe %.2f" %
+              (self.strategy.datetime.datetime(0),m['bars'],time.time()-self.t,m['pnl'],m['trades'],m['strike_rate'],
+               m['drawdown'],m['max_drawdown'],m['sqn'] or 0,m['sharpe_ratio'] or 0))
+
+# parity with backtrader's analyzers, on the strategies of the vectorized check
+
+def stock_metrics(algo):
+    """ The OnlineMetrics keys from the stock analyzers of a finished run """
+    s=algo.thestrat.analyzers
+    ta=s.stock_ta.get_analysis()
+    dd=s.stock_dd.get_analysis()
+    closed=ta.total.get('closed',0)
+    return {'trades': closed,
+            'won': ta.won.total if closed else 0,
+            'lost': ta.lost.total if closed else 0,
+            'open': ta.total.get('open',0),
+            'strike_rate': 100.0*ta.won.total/closed if closed else 0,
+            'longest_won': ta.streak.won.longest if closed else 0,
+            'longest_lost': ta.streak.lost.longest if closed else 0,
+            'net': ta.pnl.net.total if closed else 0.0,
+            'max_drawdown': dd.max.drawdown,
+            'max_moneydown': dd.max.moneydown,
+            'drawdown': dd.drawdown,
+            'pnl': algo.cerebro.broker.getvalue()-algo.portfolioStartValue,
+            'sqn': s.stock_sqn.get_analysis().sqn,
+            'sharpe_ratio': s.stock_sharpe.get_analysis()['sharperatio']}
+
+def _run(datafile,strategy,params,stock=True):
+    from algo_base import AlgoStrategy
+    from algo_vectorized import _reference_strategies
+    data=bt.feeds.GenericCSVData(dataname=datafile,dtformat=('%Y-%m-%d'),timeframe=bt.TimeFrame.Days,
+                                 datetime=0,time=-1,open=1,high=2,low=3,close=4,volume=5,openinterest=-1)
+    config={k:str(v) for k,v in params.items()}
+    config['chart']='false'
+    algo=AlgoStrategy(config,_reference_strategies()[strategy],data)
+    if stock:
+        algo.cerebro.addanalyzer(bt.analyzers.DrawDown, _name='stock_dd')
+        algo.cerebro.addanalyzer(bt.analyzers.SharpeRatio_A, _name='stock_sharpe')
+        algo.cerebro.addanalyzer(bt.analyzers.SQN, _name='stock_sqn')
+        algo.cerebro.addanalyzer(bt.analyzers.TradeAnalyzer, _name='stock_ta')
+    with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+        algo.run()
+    return algo
+
+def parity(datafile,cases=None,tol=1e-9):
+    """ Compare OnlineMetrics with the stock analyzers of the same runs
+    Returns:
+        ok: True if every value agrees within tol (relative)
+    """
+    from algo_vectorized import PARITY_CASES
+    ok=True
+    for strategy,params in cases or PARITY_CASES:
+        algo=_run(datafile,strategy,params)
+        ref=stock_metrics(algo)
+        online=algo.thestrat.analyzers.online.get_analysis()
+        bad=[]
+        for k,v in ref.items():
+            w=online[k]
+            if v is None or w is None:
+                same=(v is None and w is None)
+            else:
+                same=abs(v-w)<=tol*max(1.0,abs(v))
+            if not same:
+                bad.append("%s: backtrader=%s online=%s" % (k,v,w))
+        ok=ok and not bad
+        print("[PARITY] %s %s %s" % (strategy,params,'ok' if not bad else 'MISMATCH '+', '.join(bad)))
+    print("[PARITY] %s" % ('all cases agree' if ok else 'mismatches found'))
+    return ok
+
+def benchmark(datafile,strategy='sma',repeat=5):
+    """ Run time with the online metrics only and with the stock analyzers
+    added, best of repeat runs """
+    params={'fast_period':10,'slow_period':50,'size':100}
+    res={}
+    for stock in [False,True]:
+        best=None
+        for _ in range(repeat):
+            algo=_run(datafile,strategy,params,stock)
+            best=algo.elapsed if best is None else min(best,algo.elapsed)
+        res[stock]=best
+    print("[BENCH] %s: %.3fs with the online metrics, %.3fs with the stock analyzers too" % (strategy,res[False],res[True]))
+    return res
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv)>2 and sys.argv[2]=='bench':
+        benchmark(sys.argv[1])
+    else:
+        sys.exit(0 if parity(sys.argv[1]) else 1)
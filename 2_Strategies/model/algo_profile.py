@@ -0,0 +1,170 @@
+import json
+import os
+import time
+
+import backtrader as bt
+from backtrader.lineiterator import LineIterator
+
+# Per-bar profile of a backtest: call counts and latency histograms of the
+# phases of every bar, the feed _load, the broker, order and trade
+# notifications, the indicator updates, StrategyTemplate.next, the next of
+# the strategy itself (without StrategyTemplate.next), the analyzers and the
+# observers. Nothing is wrapped unless "profile_bars": "true" is set, the
+# summary is then printed and written next to chart.png as profile.txt and
+# profile.json.
+#
+# Histogram buckets are powers of two of microseconds, bucket b holds the
+# calls that took less than 2**b us.
+#
+#   python algo_profile.py profile.json [baseline profile.json]
+
+PHASES = ['feed','broker','notify_order','notify_trade','indicators','template','next','analyzers','observers']
+
+clock = time.perf_counter
+
+class Phase(object):
+    """ Calls, total and maximum seconds and histogram of one phase """
+    __slots__=('count','total','max','buckets')
+
+    def __init__(self):
+        self.count=0
+        self.total=0.0
+        self.max=0.0
+        self.buckets=[0]*32
+
+    def add(self,elapsed):
+        self.count+=1
+        self.total+=elapsed
+        if elapsed>self.max:
+            self.max=elapsed
+        self.buckets[min(int(elapsed*1e6).bit_length(),31)]+=1
+
+    def percentile(self,q):
+        """ Upper bound in seconds of the q quantile """
+        n=0
+        for b,c in enumerate(self.buckets):
+            n+=c
+            if n>=q*self.count:
+                return (1<<b)*1e-6
+        return self.max
+
+class BarProfiler(object):
+    """ Phases of a run, filled by the wrappers of instrument() and by the
+    hook of StrategyTemplate.next """
+    def __init__(self):
+        self.phases={x:Phase() for x in PHASES}
+        self.elapsed=None
+
+    def add(self,name,elapsed):
+        self.phases[name].add(elapsed)
+
+    def wrap(self,obj,attr,name):
+        """ Time obj.attr() as the phase name, on this instance only """
+        fn=getattr(obj,attr)
+        phase=self.phases[name]
+        def timed(*args,**kwargs):
+            t=clock()
+            try:
+                return fn(*args,**kwargs)
+            finally:
+                phase.add(clock()-t)
+        setattr(obj,attr,timed)
+
+    def wrap_next(self,strategy):
+        """ Time the next of the strategy without the StrategyTemplate.next
+        it calls, which is timed by its own hook """
+        fn=strategy.next
+        phase=self.phases['next']
+        template=self.phases['template']
+        def timed(*args,**kwargs):
+            before=template.total
+            t=clock()
+            try:
+                return fn(*args,**kwargs)
+            finally:
+                phase.add(clock()-t-(template.total-before))
+        strategy.next=timed
+
+    def instrument_cerebro(self,cerebro):
+        """ Feeds and broker, before the run so preloading is timed too """
+        for data in cerebro.datas:
+            self.wrap(data,'_load','feed')
+        self.wrap(cerebro.broker,'next','broker')
+        cerebro.addanalyzer(BarProfile,_name='profile',profiler=self)
+
+    def instrument_strategy(self,strategy):
+        for ind in strategy._lineiterators[LineIterator.IndType]:
+            self.wrap(ind,'_next','indicators')
+            self.wrap(ind,'_once','indicators')
+        for analyzer in strategy.analyzers:
+            if not isinstance(analyzer,BarProfile):
+                for attr in ['_next','_prenext','_nextstart']:
+                    self.wrap(analyzer,attr,'analyzers')
+        self.wrap(strategy,'notify_order','notify_order')
+        self.wrap(strategy,'notify_trade','notify_trade')
+        self.wrap(strategy,'_next_observers','observers')
+        self.wrap_next(strategy)
+        strategy.profiler=self
+
+    def summary(self):
+        res={'elapsed':self.elapsed,'phases':{}}
+        for name in PHASES:
+            p=self.phases[name]
+            if p.count:
+                res['phases'][name]={'count':p.count,'total':p.total,'mean':p.total/p.count,'max':p.max,
+                                     'p50':p.percentile(0.5),'p90':p.percentile(0.9),'p99':p.percentile(0.99),
+                                     'buckets':p.buckets[:max(b for b,c in enumerate(p.buckets) if c)+1]}
+        return res
+
+    def lines(self):
+        s=self.summary()
+        out=["%-13s %9s %10s %6s %9s %9s %9s %9s %10s" % ('phase','calls','total ms','%','mean us','p50 us','p90 us','p99 us','max us')]
+        timed=0.0
+        for name,p in s['phases'].items():
+            timed+=p['total']
+            out.append("%-13s %9d %10.1f %6.1f %9.2f %9.0f %9.0f %9.0f %10.0f" %
+                       (name,p['count'],p['total']*1000,100.0*p['total']/s['elapsed'] if s['elapsed'] else 0,
+                        p['mean']*1e6,p['p50']*1e6,p['p90']*1e6,p['p99']*1e6,p['max']*1e6))
+        if s['elapsed']:
+            out.append("%-13s %9s %10.1f %6.1f" % ('other','',(s['elapsed']-timed)*1000,100.0*(s['elapsed']-timed)/s['elapsed']))
+            out.append("%-13s %9s %10.1f" % ('run','',s['elapsed']*1000))
+        return out
+
+    def report(self,d):
+        """ Print the summary and write profile.txt and profile.json in d """
+        lines=self.lines()
+        for line in lines:
+            print("[PROFILE] %s" % line)
+        os.makedirs(d,exist_ok=True)
+        with open(os.path.join(d,'profile.txt'), 'w') as f:
+            f.write('\n'.join(lines)+'\n')
+        with open(os.path.join(d,'profile.json'), 'w') as f:
+            f.write(json.dumps(self.summary()))
+
+class BarProfile(bt.Analyzer):
+    """ Instruments the strategy when it starts, its indicators, analyzers
+    and notifications exist by then """
+    params=(('profiler',None),)
+
+    def start(self):
+        self.p.profiler.instrument_strategy(self.strategy)
+
+def compare(path,baseline):
+    """ Mean time per call of every phase against a baseline profile.json """
+    with open(path, 'r') as f:
+        new=json.load(f)['phases']
+    with open(baseline, 'r') as f:
+        old=json.load(f)['phases']
+    for name in PHASES:
+        if name in new and name in old:
+            a=old[name]['mean']*1e6
+            b=new[name]['mean']*1e6
+            print("[PROFILE] %-13s %9.2f us -> %9.2f us (%+.0f%%)" % (name,a,b,100.0*(b-a)/a if a else 0))
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv)>2:
+        compare(sys.argv[1],sys.argv[2])
+    else:
+        with open(sys.argv[1], 'r') as f:
+            print(json.dumps(json.load(f),indent=1))
@@ -0,0 +1,87 @@
+import multiprocessing
+import os
+import sys
+import time
+
+import pandas as pd
+
+from algo_base import AlgoStrategy, StrategyTemplate
+from algo_sim_feed import AlgoSimData, load_paths
+
+# Monte Carlo stress test: run one strategy over many simulated GBM paths
+# and report the distribution of its performance metrics.
+
+METRICS = ['pnl','sharpe_ratio','max_drawdown','sqn','trades','strike_rate']
+
+# set once per worker process by _init_worker
+_strategy=None
+_config=None
+_dates=None
+_paths=None
+
+def _init_worker(strategy,config,spec,datafile,cache_dir,quiet):
+    global _strategy,_config,_dates,_paths
+    if quiet:
+        sys.stdout=open(os.devnull, 'w')
+    _strategy=strategy
+    _config=config
+    # memory-mapped from the cache, the paths are not copied to each worker
+    _dates,_paths=load_paths(spec,datafile,cache_dir)
+
+def _run_scenario(i):
+    data=AlgoSimData(dates=_dates,prices=_paths[i])
+    algo=AlgoStrategy(_config,_strategy,data)
+    algo.run()
+    m=algo.metrics()
+    m['scenario']=i
+    return m
+
+def run_scenarios(config,strategy,datafile,spec,workers=None,quiet=True,cache_dir=None):
+    """ Run a strategy over the GBM paths of spec in a process pool
+    Args:
+        config: hyperparameters
+        strategy: StrategyTemplate subclass
+        datafile: csv the drift and volatility are estimated from
+        spec: ScenarioSpec
+        workers: number of processes, cpu count if None
+        quiet: silence the per-bar output of the runs
+        cache_dir: scenario cache, next to datafile if None
+    Returns:
+        results: frame with one row of metrics per scenario
+    """
+    dates, paths = load_paths(spec, datafile, cache_dir)
+    n_scenarios = paths.shape[0]
+    print("[SCENARIOS] %s paths of %s days" % (n_scenarios,len(dates)))
+
+    # the runs only report metrics
+    config=dict(config)
+    config['chart']='false'
+    config.pop('submitUrl',None)
+
+    if workers is None:
+        workers=multiprocessing.cpu_count()
+    t=time.time()
+    pool=multiprocessing.Pool(workers,initializer=_init_worker,initargs=(strategy,config,spec,datafile,cache_dir,quiet))
+    try:
+        rows=pool.map(_run_scenario,range(n_scenarios))
+    finally:
+        pool.close()
+        pool.join()
+    print("[SCENARIOS] ran %s scenarios with %s workers in %.3fs" % (n_scenarios,workers,time.time()-t))
+
+    results=pd.DataFrame(rows).set_index('scenario').sort_index()
+    return results
+
+def summary(results):
+    """ Distribution of the metrics over all scenarios """
+    # float, so a metric that is None in every scenario (sqn with less than
+    # two trades) is kept as NaN instead of dropped by describe
+    return results[METRICS].astype(float).describe(percentiles=[0.05,0.25,0.5,0.75,0.95])
+
+def save(results,path=StrategyTemplate.MODEL_PATH):
+    results.to_csv(os.path.join(path,'scenarios.csv'))
+    s=summary(results)
+    s.to_csv(os.path.join(path,'scenarios_summary.csv'))
+    print(s.to_string())
+    print('[Median SQN:%.2f, Sharpe Ratio:%.2f, Total PnL:%.2f]' % (s.loc['50%','sqn'],s.loc['50%','sharpe_ratio'],s.loc['50%','pnl']))
+    return s
@@ -1,72 +1,182 @@
-import datetime
-import struct
+import hashlib
+import json
+import os
 import time
 
 from backtrader.feed import DataBase
 from backtrader import date2num
-from backtrader import TimeFrame
 import backtrader as bt
 
 import numpy as np
-import pandas as pd
+
+# pandas is imported where it is used, algo_base imports this module and
+# most runs never simulate
+from trading_calendar import default_calendar
+
+# day number of 1970-01-01 in backtrader's date2num convention
+EPOCH_ORDINAL = 719163
 
 # Based on this: https://towardsdatascience.com/simulating-stock-prices-in-python-using-geometric-brownian-motion-8dfd6e8c6b18
 
+def estimate_gbm(df):
+    """ Start price, mean and standard deviation of the daily close returns
+    Args:
+        df: frame with dt and close columns
+    Returns:
+        So, mu, sigma
+    """
+    S_eon = df[["dt","close"]].reset_index(drop=True)
+
+    returns = (S_eon.loc[1:, 'close'] - \
+               S_eon.shift(1).loc[1:, 'close']) / \
+               S_eon.shift(1).loc[1:, 'close']
+
+    So = S_eon.loc[S_eon.shape[0] - 1, "close"]
+    mu = np.mean(returns)
+    sigma = np.std(returns)
+    return So, mu, sigma
+
+def sim_dates(last_date,horizon):
+    """ Last known date followed by horizon trading sessions """
+    import pandas as pd
+    last_date = pd.to_datetime(last_date)
+    days = default_calendar().sessions_after(last_date, int(horizon))
+    return pd.DatetimeIndex([last_date]).append(pd.DatetimeIndex(days))
+
+def gbm_paths(So,mu,sigma,n_days,n_scenarios=1,rng=np.random):
+    """ Geometric brownian motion paths in one vectorized pass
+    Args:
+        So: start price
+        mu: mean daily return
+        sigma: standard deviation of daily returns
+        n_days: number of simulated days
+        n_scenarios: number of paths
+        rng: source of the normal draws
+    Returns:
+        S: array of shape (n_scenarios, n_days + 1), starting with So
+    """
+    t = np.arange(1, int(n_days) + 1)
+    W = rng.normal(0, 1, (n_scenarios, int(n_days))).cumsum(axis=1)
+
+    # Calculating drift and diffusion components
+    drift = (mu - 0.5 * sigma**2) * t
+    diffusion = sigma * W
+
+    # Making the predictions
+    S = np.empty((n_scenarios, int(n_days) + 1))
+    S[:, 0] = So
+    S[:, 1:] = So * np.exp(drift + diffusion)
+    return S
+
+def file_hash(path):
+    h=hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1<<20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class ScenarioSpec(object):
+    """ Everything the simulated paths depend on
+    Args:
+        seed: seed of the np.random.Generator
+        window: number of trailing returns mu and sigma are estimated from, all if None
+        horizon: number of simulated trading sessions after the last known date
+        n_paths: number of paths
+    """
+    def __init__(self,seed=0,window=None,horizon=252,n_paths=1):
+        self.seed=int(seed)
+        self.window=None if window is None else int(window)
+        self.horizon=int(horizon)
+        self.n_paths=int(n_paths)
+
+    @staticmethod
+    def from_config(config):
+        return ScenarioSpec(seed=config.get('sim_seed',0),
+                            window=config.get('sim_window'),
+                            horizon=config.get('sim_horizon',252),
+                            n_paths=config.get('scenarios',1))
+
+    def to_dict(self):
+        return {'seed':self.seed,'window':self.window,'horizon':self.horizon,'n_paths':self.n_paths}
+
+    def key(self,datafile):
+        """ Cache key of the spec applied to the content of datafile """
+        h=hashlib.sha256(json.dumps(self.to_dict(),sort_keys=True).encode('utf-8'))
+        h.update(file_hash(datafile).encode('utf-8'))
+        return h.hexdigest()[:32]
+
+    def generate(self,datafile):
+        """ Returns:
+            dates: DatetimeIndex of horizon + 1 days
+            paths: array of shape (n_paths, horizon + 1)
+        """
+        import pandas as pd
+        df = pd.read_csv(datafile,infer_datetime_format=True, parse_dates=['dt'])
+        if self.window is not None:
+            df = df.iloc[-(self.window + 1):]
+        So, mu, sigma = estimate_gbm(df)
+        dates = sim_dates(df["dt"].max(), self.horizon)
+        rng = np.random.default_rng(self.seed)
+        paths = gbm_paths(So, mu, sigma, self.horizon, self.n_paths, rng)
+        return dates, paths
+
+def _save(d,name,values):
+    """ Write name.npy in d through a file of this process and a rename, so
+    readers never see it half written """
+    tmp=os.path.join(d,'%s.%s.npy' % (name,os.getpid()))
+    np.save(tmp,values)
+    os.rename(tmp,os.path.join(d,name+'.npy'))
+
+def load_paths(spec,datafile,cache_dir=None):
+    """ Paths of spec, generated once and then memory-mapped from the cache
+    The cache lives next to datafile by default, so later runs on the same
+    data in the same container or notebook reuse it.
+    Returns:
+        dates: DatetimeIndex of horizon + 1 days
+        paths: array of shape (n_paths, horizon + 1)
+    """
+    import pandas as pd
+    if cache_dir is None:
+        cache_dir=os.path.join(os.path.dirname(os.path.abspath(datafile)),'scenario_cache')
+    d=os.path.join(cache_dir,spec.key(datafile))
+    if not os.path.exists(os.path.join(d,'paths.npy')):
+        t=time.time()
+        dates,paths=spec.generate(datafile)
+        os.makedirs(d,exist_ok=True)
+        _save(d,'dates',dates.values.astype('datetime64[D]'))
+        with open(os.path.join(d,'spec.json'), 'w') as f:
+            f.write(json.dumps(spec.to_dict()))
+        # written last, its presence marks a complete entry
+        _save(d,'paths',paths)
+        print("SimData cache store:%s,paths=%s,time=%.3fs" % (d,spec.n_paths,time.time()-t))
+    else:
+        print("SimData cache hit:%s" % d)
+    dates=pd.DatetimeIndex(np.load(os.path.join(d,'dates.npy')))
+    paths=np.load(os.path.join(d,'paths.npy'),mmap_mode='r')
+    return dates,paths
+
 class AlgoSimData(DataBase):
-    def __init__(self,datafile):
+    def __init__(self,datafile=None,dates=None,prices=None,spec=None,path=0):
         super(AlgoSimData, self).__init__()
+        import pandas as pd
 
-        df = pd.read_csv(datafile,infer_datetime_format=True, parse_dates=['dt'])
-       
-        start_date = '2012-08-13'
-        end_date = '2017-08-11'
-        
-        now = datetime.datetime.now() # current date and time
-        pred_end_date = now.strftime("%Y-%m-%d")
-        
-        self.fromdate=pd.to_datetime(end_date, format = "%Y-%m-%d")
-        self.todate=pd.to_datetime(pred_end_date, format = "%Y-%m-%d")
+        if prices is None:
+            if spec is None:
+                spec=ScenarioSpec()
+            dates, paths = load_paths(spec, datafile)
+            prices = paths[path]
+
+        self.fromdate=dates[0]
+        self.todate=dates[-1]
         self.timeframe=bt.TimeFrame.Days
 
-        S_eon = df[["dt","close"]]
-
-        returns = (S_eon.loc[1:, 'close'] - \
-                   S_eon.shift(1).loc[1:, 'close']) / \
-                   S_eon.shift(1).loc[1:, 'close']
-
-        # Parameter Assignments
-        So = S_eon.loc[S_eon.shape[0] - 1, "close"]
-        dt = 1 # day   # User input
-        n_of_wkdays = pd.date_range(start = pd.to_datetime(end_date, 
-                         format = "%Y-%m-%d") + pd.Timedelta('1 days'), 
-                         end = pd.to_datetime(pred_end_date, 
-                         format = "%Y-%m-%d")).to_series().map(lambda x: 
-                         1 if x.isoweekday() in range(1,6) else 0).sum()
-        T = n_of_wkdays # days  # User input -> follows from pred_end_date
-        N = T / dt
-        t = np.arange(1, int(N) + 1)
-        mu = np.mean(returns)
-        sigma = np.std(returns)
-        scen_size = 1 # User input
-        b = {str(scen): np.random.normal(0, 1, int(N)) for scen in range(1, scen_size + 1)}
-        W = {str(scen): b[str(scen)].cumsum() for scen in range(1, scen_size + 1)}
-
-        # Calculating drift and diffusion components
-        drift = (mu - 0.5 * sigma**2) * t
-        diffusion = {str(scen): sigma * W[str(scen)] for scen in range(1, scen_size + 1)}
-
-        # Making the predictions
-        S = np.array([So * np.exp(drift + diffusion[str(scen)]) for scen in range(1, scen_size + 1)]) 
-        S = np.hstack((np.array([[So] for scen in range(scen_size)]), S)) # add So to the beginning series
-
-        # Dataframe format for predictions - first 10 scenarios only
-        self.df = pd.DataFrame(S.swapaxes(0, 1)[:, :10]).set_index(
-                   pd.date_range(start = S_eon["dt"].max(), 
-                   end = pred_end_date, freq = 'D').map(lambda x:
-                   x if x.isoweekday() in range(1, 6) else np.nan).dropna()
-                   ).reset_index(drop = False)
-        print("SimData generated:from=%s,to=%s,count=%s" % (self.fromdate,self.todate,len(self.df)))
+        # contiguous arrays served by _load, converted once instead of per bar
+        days=pd.DatetimeIndex(dates).values.astype('datetime64[us]').astype(np.int64)
+        self._dt=np.ascontiguousarray(days/86400e6+EPOCH_ORDINAL,dtype=np.float64)
+        self._close=np.ascontiguousarray(prices,dtype=np.float64)
+        self.count=len(self._close)
         self.n=0
+        print("SimData generated:from=%s,to=%s,count=%s" % (self.fromdate,self.todate,self.count))
  
     def start(self):
         print("start feed")
@@ -75,26 +185,65 @@ class AlgoSimData(DataBase):
         print("stop feed")
 
     def _load(self):
-        #print("load feed")
-        if self.n>=len(self.df):
+        n=self.n
+        if n>=self.count:
             return False
-        
-        v=self.df.values
-        #print(v)
-        #print(self.n)
-        dt=v[self.n][0]
-        close=v[self.n][1]
-        #print("%s:%s:%s" % (self.n,dt,close))
-        
-        self.lines.datetime[0] = date2num(dt)
-        
-        print(self.num2date(self.lines.datetime[0]))
-        
+
+        close=self._close[n]
+        self.lines.datetime[0] = self._dt[n]
         self.lines.open[0] = close
         self.lines.high[0] = close
         self.lines.low[0] = close
         self.lines.close[0] = close
         self.lines.volume[0] = 0
-        
-        self.n=self.n+1
-        return True
\ No newline at end of file
+
+        self.n=n+1
+        return True
+
+def benchmark(datafile,repeat=3):
+    """ Bars/second of the array-backed _load against the previous
+    DataFrame.values per bar access
+    """
+    import pandas as pd
+
+    class DataFrameSimData(AlgoSimData):
+        def __init__(self,datafile):
+            super(DataFrameSimData, self).__init__(datafile)
+            # the frame the feed used to keep, rebuilt from its arrays
+            self.df = pd.DataFrame({'index': pd.to_datetime(self._dt-EPOCH_ORDINAL,unit='D'), 0: self._close})
+
+        def _load(self):
+            if self.n>=len(self.df):
+                return False
+            v=self.df.values
+            dt=v[self.n][0]
+            close=v[self.n][1]
+            self.lines.datetime[0] = date2num(dt)
+            self.lines.open[0] = close
+            self.lines.high[0] = close
+            self.lines.low[0] = close
+            self.lines.close[0] = close
+            self.lines.volume[0] = 0
+            self.n=self.n+1
+            return True
+
+    res={}
+    for name,cls in [('dataframe',DataFrameSimData),('array',AlgoSimData)]:
+        best=0
+        for r in range(repeat):
+            data=cls(datafile)
+            data.setenvironment(bt.Cerebro())
+            data._start()
+            t=time.time()
+            bars=0
+            while data.load():
+                bars+=1
+            best=max(best,bars/(time.time()-t))
+        res[name]=best
+        print("[BENCH] %s: %s bars, %.0f bars/s" % (name,bars,best))
+    print("[BENCH] speedup=%.1fx" % (res['array']/res['dataframe']))
+    return res
+
+if __name__ == '__main__':
+    import sys
+    benchmark(sys.argv[1])
\ No newline at end of file
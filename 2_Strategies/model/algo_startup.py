@@ -0,0 +1,209 @@
+import builtins
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Cold start of the train and serve entry points: an import profiler they
+# install before importing algo_base and the strategy, and a benchmark of
+# the time from process start to the first bar of every sample strategy of
+# the notebooks. Only the standard library is imported here.
+#
+# train: "profile_imports": "true" in the hyperparameters, serve: ALGO_PROFILE_IMPORTS=1
+#
+#   python algo_startup.py data.csv [notebook ...]
+
+SAMPLE_NOTEBOOKS = ['../Strategy_SMA.ipynb','../Strategy_Breakout.ipynb','../Strategy_ML_Forecast.ipynb',
+                    '../../4_Kinesis/Strategy_Kinesis_EMA_HPO.ipynb']
+
+def process_uptime():
+    """ Seconds since this process started, None where /proc is missing """
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            # the command name may hold spaces, fields are counted after it
+            start=float(f.read().rsplit(')',1)[1].split()[19])/os.sysconf('SC_CLK_TCK')
+        with open('/proc/uptime', 'r') as f:
+            return float(f.read().split()[0])-start
+    except (OSError,IndexError,ValueError):
+        return None
+
+class ImportProfiler(object):
+    """ Times every import statement that loads new modules while installed,
+    with the time of the nested imports and the time of the module itself """
+    def __init__(self):
+        self.records=[]
+        self._stack=[]
+        self._import=None
+
+    def start(self):
+        self._import=builtins.__import__
+        builtins.__import__=self._timed_import
+        self.t0=time.time()
+        return self
+
+    def stop(self):
+        if self._import is not None:
+            builtins.__import__=self._import
+            self._import=None
+        return self
+
+    def _timed_import(self,name,globals=None,locals=None,fromlist=(),level=0):
+        if level==0 and not fromlist and name in sys.modules:
+            return self._import(name,globals,locals,fromlist,level)
+        count=len(sys.modules)
+        self._stack.append(0.0)
+        t=time.time()
+        try:
+            return self._import(name,globals,locals,fromlist,level)
+        finally:
+            elapsed=time.time()-t
+            nested=self._stack.pop()
+            if self._stack:
+                self._stack[-1]+=elapsed
+            if len(sys.modules)>count:
+                if level and globals:
+                    package=globals.get('__package__') or ''
+                    name=package+'.'+name if name else '%s.{%s}' % (package,','.join(fromlist))
+                self.records.append((name,elapsed,elapsed-nested,len(sys.modules)-count))
+
+    def top(self,n=15):
+        """ Slowest top-level imports: (name, total, self, modules loaded) """
+        return sorted(self.records,key=lambda x:-x[1])[:n]
+
+    def report(self,n=15,label=''):
+        self.stop()
+        total=time.time()-self.t0
+        print("[IMPORT] %s %.0fms importing, %s modules" % (label,total*1000,len(sys.modules)))
+        print("[IMPORT] %10s %10s %8s  %s" % ('total ms','self ms','modules','name'))
+        for name,elapsed,own,count in self.top(n):
+            print("[IMPORT] %10.1f %10.1f %8d  %s" % (elapsed*1000,own*1000,count,name))
+        uptime=process_uptime()
+        if uptime is not None:
+            print("[STARTUP] %s %.0fms since process start" % (label,uptime*1000))
+
+def profiler(config=None):
+    """ A started ImportProfiler if asked for by the hyperparameters or the
+    environment, else None """
+    enabled=os.environ.get('ALGO_PROFILE_IMPORTS','')
+    if config is not None:
+        enabled=str(config.get('profile_imports',enabled))
+    if enabled.lower() in ['1','true']:
+        return ImportProfiler().start()
+    return None
+
+def sample_strategies(notebooks,dest):
+    """ Write the strategy and hyperparameters cells of the notebooks as
+    algo_sample_<name>.py and <module>.json
+    Returns:
+        modules: list of module names
+    """
+    modules=[]
+    for nb_path in notebooks:
+        with open(nb_path, 'r') as f:
+            nb=json.load(f)
+        module='algo_sample_'+re.sub(r'^Strategy_','',os.path.splitext(os.path.basename(nb_path))[0]).lower()
+        code=None
+        config=None
+        for c in nb['cells']:
+            src=''.join(c['source'])
+            first,_,body=src.partition('\n')
+            if first.startswith('%%writefile model/'):
+                code=body
+            elif first.startswith('%%writefile') and first.endswith('hyperparameters.json'):
+                config=body
+        if code is None:
+            continue
+        with open(os.path.join(dest,module+'.py'), 'w') as f:
+            f.write(code)
+        with open(os.path.join(dest,module+'.json'), 'w') as f:
+            f.write(config or '{}')
+        modules.append(module)
+    return modules
+
+# run in a fresh interpreter by time_to_first_bar: argv model dir, module dir, module, prefix, start time
+PROBE = """
+import sys,time,os,json
+sys.path[:0]=[sys.argv[2],sys.argv[1]]
+import algo_startup
+profiler=algo_startup.ImportProfiler().start()
+from algo_base import AlgoStrategy, StrategyTemplate
+prefix=sys.argv[4]
+StrategyTemplate.PREFIX=prefix
+StrategyTemplate.TRAIN_FILE=os.path.join(prefix,'input/data/training/data.csv')
+StrategyTemplate.COLUMNAR_PATH=os.path.join(prefix,'input/data/training/columnar')
+StrategyTemplate.CONFIG_FILE=os.path.join(prefix,'input/config/hyperparameters.json')
+StrategyTemplate.MODEL_PATH=os.path.join(prefix,'model')
+import importlib
+cls=getattr(importlib.import_module(sys.argv[3]),'MyStrategy')
+profiler.stop()
+imported=time.time()
+def first_bar(self):
+    print(json.dumps({'imported':imported-float(sys.argv[5]),'first_bar':time.time()-float(sys.argv[5]),
+                      'top':[(n,e) for n,e,s,c in profiler.top(5)]}))
+    sys.stdout.flush()
+    os._exit(0)
+cls.prenext=first_bar
+cls.next=first_bar
+with open(StrategyTemplate.CONFIG_FILE) as f:
+    config=json.load(f)
+config['chart']='false'
+AlgoStrategy(config,cls).run()
+"""
+
+def time_to_first_bar(module,module_dir,datafile,config):
+    """ Seconds from spawning an interpreter to the import of the strategy
+    and to its first bar, in a fresh process like a training job
+    Returns:
+        {'imported','first_bar','top'} or {'error'}
+    """
+    model_dir=os.path.dirname(os.path.abspath(__file__))
+    prefix=tempfile.mkdtemp(prefix='startup')
+    try:
+        for d in ['input/config','input/data/training','model']:
+            os.makedirs(os.path.join(prefix,d))
+        shutil.copy(datafile,os.path.join(prefix,'input/data/training/data.csv'))
+        with open(os.path.join(prefix,'input/config/hyperparameters.json'), 'w') as f:
+            f.write(json.dumps(config))
+        t=time.time()
+        p=subprocess.run([sys.executable,'-c',PROBE,model_dir,module_dir,module,prefix,repr(t)],
+                         cwd=model_dir,stdout=subprocess.PIPE,stderr=subprocess.PIPE,universal_newlines=True)
+        for line in reversed(p.stdout.splitlines()):
+            if line.startswith('{'):
+                return json.loads(line)
+        err=(p.stderr.strip().splitlines() or ['exit code %s' % p.returncode])[-1]
+        return {'error':err}
+    finally:
+        shutil.rmtree(prefix,ignore_errors=True)
+
+def benchmark(datafile,notebooks=None,repeat=3):
+    """ Time to first bar of the sample strategies, best of repeat runs """
+    if not notebooks:
+        here=os.path.dirname(os.path.abspath(__file__))
+        notebooks=[os.path.join(here,x) for x in SAMPLE_NOTEBOOKS]
+    notebooks=[x for x in notebooks if os.path.exists(x)]
+    dest=tempfile.mkdtemp(prefix='samples')
+    res={}
+    try:
+        for module in sample_strategies(notebooks,dest):
+            with open(os.path.join(dest,module+'.json'), 'r') as f:
+                config=json.load(f)
+            runs=[time_to_first_bar(module,dest,datafile,config) for _ in range(repeat)]
+            ok=[x for x in runs if 'error' not in x]
+            if not ok:
+                print("[STARTUP] %s failed: %s" % (module,runs[0]['error']))
+                continue
+            best=min(ok,key=lambda x:x['first_bar'])
+            res[module]=best
+            print("[STARTUP] %s: imported in %.0fms, first bar after %.0fms, slowest imports %s" %
+                  (module,best['imported']*1000,best['first_bar']*1000,
+                   ', '.join('%s %.0fms' % (n,e*1000) for n,e in best['top'][:3])))
+    finally:
+        shutil.rmtree(dest,ignore_errors=True)
+    return res
+
+if __name__ == '__main__':
+    benchmark(sys.argv[1],sys.argv[2:])
@@ -0,0 +1,386 @@
+import contextlib
+import itertools
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# Vectorized backtester for the signal strategies of the notebooks (SMA
+# crossover, EMA crossover, breakout). Indicators, positions and the equity
+# curve are computed over whole arrays, with the order and fill rules of the
+# backtrader runs: a signal on a bar is filled at the open of the next bar,
+# no commission, the value is marked at the close. It reports the metrics
+# of AlgoStrategy.metrics() and is meant to screen parameters before they
+# are confirmed with backtrader, see parity().
+#
+#   python algo_vectorized.py data.csv parity
+#   python algo_vectorized.py data.csv bench
+
+CASH = 100000.0
+RISK_FREE_RATE = 0.01 # SharpeRatio_A default, yearly returns
+
+def load(datafile):
+    """ Columns of a daily data.csv (dt,open,high,low,close,vol) """
+    df=pd.read_csv(datafile,parse_dates=['dt'])
+    data={'dt':df['dt'].values.astype('datetime64[D]')}
+    for x in ['open','high','low','close']:
+        data[x]=df[x].values.astype(np.float64)
+    return data
+
+def sma(close,period):
+    """ Simple moving average, NaN until period values are available """
+    out=np.full(len(close),np.nan)
+    if period<=len(close):
+        c=np.cumsum(np.concatenate([[0.0],close]))
+        out[period-1:]=(c[period:]-c[:-period])/period
+    return out
+
+def ema(close,period):
+    """ Exponential moving average seeded with the SMA of the first period
+    values, with backtrader's recursion so the values match exactly
+    """
+    out=np.full(len(close),np.nan)
+    if period>len(close):
+        return out
+    alpha=2.0/(1.0+period)
+    alpha1=1.0-alpha
+    prev=math.fsum(close[:period])/period
+    out[period-1]=prev
+    for i in range(period,len(close)):
+        out[i]=prev=prev*alpha1+close[i]*alpha
+    return out
+
+def highest(close,period):
+    """ Highest close of the last period bars, current bar included """
+    return pd.Series(close).rolling(period).max().values
+
+def lowest(close,period):
+    return pd.Series(close).rolling(period).min().values
+
+def crossover_positions(fast,slow,size,start):
+    """ Target position after each bar of the crossover strategies: long while
+    fast>slow, short while fast<slow, unchanged when equal, and short on the
+    first bar if not long
+    """
+    sig=np.where(fast>slow,1.0,np.where(fast<slow,-1.0,0.0))
+    sig[:start]=0.0
+    if start<len(sig) and sig[start]==0.0:
+        sig[start]=-1.0
+    # carry the last signal over bars where the averages are equal
+    idx=np.where(sig!=0.0,np.arange(len(sig)),0)
+    np.maximum.accumulate(idx,out=idx)
+    return sig[idx]*size
+
+def breakout_positions(close,period,size,go_long=True,go_short=True):
+    """ Target position after each bar of the breakout strategy: enter when
+    the close breaks the highest/lowest close of the previous period bars,
+    exit when it falls back. Path dependent, so the state is carried in a
+    loop over the precomputed signals.
+    """
+    hi=np.empty(len(close))
+    lo=np.empty(len(close))
+    hi[0]=lo[0]=np.nan
+    hi[1:]=highest(close,period)[:-1]
+    lo[1:]=lowest(close,period)[:-1]
+    with np.errstate(invalid='ignore'):
+        above=(close>hi).tolist()
+        below=(close<lo).tolist()
+        underHi=(close<hi).tolist()
+        overLo=(close>lo).tolist()
+    target=np.zeros(len(close))
+    pos=0.0
+    for t in range(period-1,len(close)):
+        if pos==0.0:
+            if go_long and above[t]:
+                pos=size
+            elif go_short and below[t]:
+                pos=-size
+        elif pos>0 and underHi[t]:
+            pos=0.0
+        elif pos<0 and overLo[t]:
+            pos=0.0
+        target[t]=pos
+    return target
+
+class Result(object):
+    """ Positions, equity curve and trades of a vectorized run
+    Attributes:
+        held: position during each bar, after the fill at its open
+        value: portfolio value at each close
+        trades: pnl of every closed trade
+    """
+    def __init__(self,data,target,cash=CASH):
+        o=data['open']
+        held=np.zeros(len(o))
+        held[1:]=target[:-1]
+        fills=np.diff(np.concatenate([[0.0],held]))
+        self.held=held
+        self.cash=cash-np.cumsum(fills*o)
+        self.value=self.cash+held*data['close']
+        self.dt=data['dt']
+        self.start_value=cash
+
+        # positions are only opened, closed or reversed, so a trade runs
+        # from one position change to the next
+        changes=np.flatnonzero(fills)
+        pos=held[changes]
+        price=o[changes]
+        closed=pos[:-1]!=0.0
+        self.trades=(pos[:-1]*(price[1:]-price[:-1]))[closed]
+
+    def metrics(self):
+        """ Same keys and definitions as AlgoStrategy.metrics() """
+        return equity_metrics(self.value,self.dt,self.trades,self.start_value)
+
+def equity_metrics(value,dt,trades,start_value=CASH):
+    """ Metrics of AlgoStrategy.metrics() from an equity curve
+    Args:
+        value: portfolio value at each close
+        dt: datetime64 dates of the values
+        trades: pnl of every closed trade
+        start_value: starting cash
+    """
+    trades=np.asarray(trades,dtype=np.float64)
+    n=len(trades)
+    strike_rate=100.0*np.count_nonzero(trades>=0.0)/n if n else 0
+
+    peak=np.maximum.accumulate(np.maximum(value,start_value))
+    max_drawdown=float(np.max(100.0*(peak-value)/peak)) if len(value) else 0.0
+
+    if n>1:
+        std=math.sqrt(math.fsum((trades-math.fsum(trades)/n)**2)/n)
+        sqn=math.sqrt(n)*(math.fsum(trades)/n)/std if std else None
+    else:
+        sqn=0
+
+    # returns of the calendar years, the first from the starting cash
+    years=dt.astype('datetime64[Y]')
+    last=np.flatnonzero(np.concatenate([years[1:]!=years[:-1],[True]]))
+    ends=value[last]
+    rets=ends/np.concatenate([[start_value],ends[:-1]])-1.0-RISK_FREE_RATE
+    sharpe_ratio=0
+    if len(rets):
+        avg=math.fsum(rets)/len(rets)
+        std=math.sqrt(math.fsum((rets-avg)**2)/len(rets))
+        if std:
+            sharpe_ratio=avg/std
+
+    return {'trades': n,
+            'strike_rate': strike_rate,
+            'max_drawdown': max_drawdown,
+            'pnl': float(value[-1]-start_value) if len(value) else 0.0,
+            'sqn': sqn,
+            'sharpe_ratio': sharpe_ratio}
+
+class Indicators(object):
+    """ Indicator arrays of one data set, computed once per period """
+    def __init__(self,data):
+        self.data=data
+        self.cache={}
+
+    def get(self,func,period):
+        key=(func.__name__,period)
+        if key not in self.cache:
+            self.cache[key]=func(self.data['close'],period)
+        return self.cache[key]
+
+def _flag(value):
+    return str(value).lower()=='true'
+
+def positions(ind,strategy,params):
+    """ Target positions of strategy ('sma', 'ema' or 'breakout') with the
+    hyperparameters of its notebook, as numbers or strings
+    """
+    size=int(params['size'])
+    if strategy in ('sma','ema'):
+        func=sma if strategy=='sma' else ema
+        fast_period=int(params['fast_period'])
+        slow_period=int(params['slow_period'])
+        start=max(fast_period,slow_period)-1
+        return crossover_positions(ind.get(func,fast_period),ind.get(func,slow_period),size,start)
+    if strategy=='breakout':
+        return breakout_positions(ind.data['close'],int(params['period']),size,
+                                  _flag(params.get('go_long','true')),_flag(params.get('go_short','true')))
+    raise ValueError("unknown strategy %s" % strategy)
+
+def run(data,strategy,params,cash=CASH,ind=None):
+    """ Vectorized backtest of one parameter set
+    Returns:
+        result: Result, result.metrics() has the AlgoStrategy metrics
+    """
+    if ind is None:
+        ind=Indicators(data)
+    return Result(data,positions(ind,strategy,params),cash)
+
+def screen(data,strategy,ranges,base=None,cash=CASH):
+    """ Metrics of every combination of the parameter ranges
+    Args:
+        data: columns from load()
+        strategy: 'sma', 'ema' or 'breakout'
+        ranges: {parameter:[values]}
+        base: fixed parameters, size defaults to 100
+    Returns:
+        results: frame with the parameters and metrics of every combination
+    """
+    base=dict({'size':100},**(base or {}))
+    ind=Indicators(data)
+    names=sorted(ranges)
+    rows=[]
+    for values in itertools.product(*[ranges[x] for x in names]):
+        params=dict(base,**dict(zip(names,values)))
+        m=run(data,strategy,params,cash,ind).metrics()
+        m.update(zip(names,values))
+        rows.append(m)
+    return pd.DataFrame(rows)
+
+# backtrader versions of the notebook strategies, for the parity check
+
+def _reference_strategies():
+    import backtrader as bt
+    from algo_base import StrategyTemplate
+
+    class Crossover(StrategyTemplate):
+        ma=None
+        def __init__(self):
+            super(Crossover, self).__init__()
+            self.fast = self.ma(period=int(self.config["fast_period"]))
+            self.slow = self.ma(period=int(self.config["slow_period"]))
+            self.size = int(self.config["size"])
+
+        def init_broker(broker):
+            broker.setcash(CASH)
+            broker.setcommission(commission=0.0)
+
+        def next(self):
+            super(Crossover, self).next()
+            if not self.position:
+                if self.fast[0] > self.slow[0]:
+                    self.buy(size=self.size)
+                else:
+                    self.sell(size=self.size)
+            elif self.position.size>0 and self.fast[0] < self.slow[0]:
+                self.sell(size=2*self.size)
+            elif self.position.size<0 and self.fast[0] > self.slow[0]:
+                self.buy(size=2*self.size)
+
+    class SMAStrategy(Crossover):
+        ma=bt.ind.SimpleMovingAverage
+
+    class EMAStrategy(Crossover):
+        ma=bt.ind.ExponentialMovingAverage
+
+    class BreakoutStrategy(StrategyTemplate):
+        def __init__(self):
+            super(BreakoutStrategy, self).__init__()
+            self.highest = bt.ind.Highest(period=int(self.config["period"]))
+            self.lowest = bt.ind.Lowest(period=int(self.config["period"]))
+            self.size = int(self.config["size"])
+            self.go_long = _flag(self.config.get("go_long","true"))
+            self.go_short = _flag(self.config.get("go_short","true"))
+
+        def init_broker(broker):
+            broker.setcash(CASH)
+            broker.setcommission(commission=0.0)
+
+        def next(self):
+            super(BreakoutStrategy, self).next()
+            if not self.position:
+                if self.go_long and self.datas[0] > self.highest[-1]:
+                    self.buy(size=self.size)
+                elif self.go_short and self.datas[0] < self.lowest[-1]:
+                    self.sell(size=self.size)
+            elif self.position.size>0 and self.datas[0] < self.highest[-1]:
+                self.close()
+            elif self.position.size<0 and self.datas[0] > self.lowest[-1]:
+                self.close()
+
+    return {'sma':SMAStrategy,'ema':EMAStrategy,'breakout':BreakoutStrategy}
+
+PARITY_CASES = [
+    ('sma',{'fast_period':50,'slow_period':200,'size':100}),
+    ('sma',{'fast_period':10,'slow_period':30,'size':100}),
+    ('sma',{'fast_period':5,'slow_period':21,'size':50}),
+    ('ema',{'fast_period':8,'slow_period':21,'size':100}),
+    ('ema',{'fast_period':20,'slow_period':100,'size':100}),
+    ('breakout',{'period':50,'size':100,'go_long':'true','go_short':'true'}),
+    ('breakout',{'period':20,'size':100,'go_long':'true','go_short':'false'}),
+    ('breakout',{'period':10,'size':100,'go_long':'false','go_short':'true'}),
+]
+
+def backtrader_metrics(datafile,strategy,params):
+    """ AlgoStrategy metrics of the backtrader version of strategy """
+    import backtrader as bt
+    import backtrader.feeds as btfeeds
+    from algo_base import AlgoStrategy
+    cls=_reference_strategies()[strategy]
+    data = btfeeds.GenericCSVData(
+        dataname=datafile,
+        dtformat=('%Y-%m-%d'),
+        timeframe=bt.TimeFrame.Days,
+        datetime=0,
+        time=-1,
+        high=2,
+        low=3,
+        open=1,
+        close=4,
+        volume=5,
+        openinterest=-1
+    )
+    config={k:str(v) for k,v in params.items()}
+    config['chart']='false'
+    algo=AlgoStrategy(config,cls,data)
+    with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+        algo.run()
+    return algo.metrics()
+
+def parity(datafile,cases=PARITY_CASES,tol=1e-6):
+    """ Compare the vectorized metrics with backtrader for the cases
+    Returns:
+        ok: True if every metric agrees within tol (relative)
+    """
+    data=load(datafile)
+    ok=True
+    for strategy,params in cases:
+        vec=run(data,strategy,params).metrics()
+        ref=backtrader_metrics(datafile,strategy,params)
+        bad=[]
+        for k,v in ref.items():
+            w=vec[k]
+            if v is None or w is None:
+                same=(v is None and w is None)
+            else:
+                same=abs(v-w)<=tol*max(1.0,abs(v))
+            if not same:
+                bad.append("%s: backtrader=%s vectorized=%s" % (k,v,w))
+        ok=ok and not bad
+        print("[PARITY] %s %s %s" % (strategy,params,'ok' if not bad else 'MISMATCH '+', '.join(bad)))
+    print("[PARITY] %s" % ('all cases agree' if ok else 'mismatches found'))
+    return ok
+
+def benchmark(datafile,strategy='sma',count=20):
+    """ Runs/second of backtrader and of the vectorized engine """
+    data=load(datafile)
+    params={'fast_period':10,'slow_period':50,'size':100,'period':20}
+    t=time.time()
+    backtrader_metrics(datafile,strategy,params)
+    bt_rate=1.0/(time.time()-t)
+
+    fast=list(range(5,5+count))
+    slow=list(range(20,20+5*count,5))
+    ranges={'period':fast} if strategy=='breakout' else {'fast_period':fast,'slow_period':slow}
+    t=time.time()
+    results=screen(data,strategy,ranges)
+    vec_rate=len(results)/(time.time()-t)
+    print("[BENCH] %s, %s bars: backtrader %.1f runs/s, vectorized %.0f runs/s (%.0fx)" %
+          (strategy,len(data['close']),bt_rate,vec_rate,vec_rate/bt_rate))
+    return bt_rate,vec_rate
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv)>2 and sys.argv[2]=='bench':
+        for s in ['sma','ema','breakout']:
+            benchmark(sys.argv[1],s)
+    else:
+        sys.exit(0 if parity(sys.argv[1]) else 1)
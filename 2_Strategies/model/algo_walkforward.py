@@ -0,0 +1,209 @@
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from algo_base import AlgoStrategy, StrategyTemplate
+from algo_columnar_feed import AlgoColumnarData, EPOCH_ORDINAL, load_columns, write_columnar
+from algo_sweep import METRICS, grid, parse_ranges
+from algo_vectorized import equity_metrics
+
+# Walk-forward optimization: the data is cut into consecutive test windows,
+# each preceded by a train window (rolling: the last train bars, anchored:
+# every bar from the start). The parameters are optimized on every train
+# window and evaluated on the test window that follows, so every test result
+# is out of sample. The test windows do not overlap and their daily PnL is
+# stitched into one out-of-sample equity curve.
+#
+# hyperparameters.json: "walkforward": {"train":500,"test":125,"anchored":false},
+#                       "sweep": {"fast_period":"5:20:5","slow_period":"30:90:20"}
+#
+# The evaluation of a window runs over its train and test bars with the
+# chosen parameters, so indicators are warmed up and positions carry into
+# the test window as they would live; only the test bars are counted. The
+# out-of-sample trade statistics (SQN, strike rate, trade count) only count
+# the trades opened and closed in a test window: a position carried in from
+# the train window moves the test equity from the first test bar on, but its
+# trade was opened in sample and is left out.
+
+# set once per worker process by _init_worker
+_strategy=None
+_config=None
+_columns=None
+
+def windows(count,train,test,anchored=False):
+    """ Bar indices of the walk-forward windows
+    Args:
+        count: number of bars
+        train: bars of a train window, the first one when anchored
+        test: bars of a test window
+        anchored: train windows all start at the first bar
+    Returns:
+        windows: list of (train_start, test_start, test_end), test_end excluded
+    """
+    res=[]
+    start=train
+    while start<count:
+        res.append((0 if anchored else start-train,start,min(start+test,count)))
+        start+=test
+    return res
+
+def _init_worker(strategy,config,path,quiet):
+    global _strategy,_config,_columns
+    if quiet:
+        sys.stdout=open(os.devnull, 'w')
+    _strategy=strategy
+    _config=config
+    _columns=load_columns(path,'data')
+
+def _run(task):
+    """ One run on bars [first,last), returns its metrics, and the equity and
+    the trades opened from bar keep on when keep is not None """
+    first,last,params,keep=task
+    config=dict(_config)
+    config.update(params)
+    data=AlgoColumnarData(None,'data',columns={k:v[first:last] for k,v in _columns.items()})
+    algo=AlgoStrategy(config,_strategy,data)
+    algo.run()
+    m=algo.metrics()
+    m['cash']=algo.portfolioStartValue
+    if keep is None:
+        return m
+    value=algo.thestrat.analyzers.equity.get_analysis()['value']
+    n=keep-first
+    # value before the first test bar, the base of its daily changes
+    m['start']=value[n-1] if n>0 else algo.portfolioStartValue
+    m['value']=value[n:]
+    since=_columns['dt'][keep]
+    m['test_trades']=[t['pnl'] for t in algo.thestrat.analyzers.trades.get_analysis() if t['opened']>=since]
+    return m
+
+def _score(m,objective):
+    x=m[objective]
+    return -np.inf if x is None else x
+
+def run_walkforward(config,strategy,datafile,ranges,train,test,anchored=False,objective='pnl',workers=None,quiet=True):
+    """ Optimize on every train window and evaluate on the next test window
+    Args:
+        config: hyperparameters, the swept ones are overridden per run
+        strategy: StrategyTemplate subclass
+        datafile: daily csv, parsed once for all runs
+        ranges: {parameter:[values]} searched on every train window
+        train, test: window lengths in bars
+        anchored: train windows grow from the first bar instead of rolling
+        objective: metric maximized on the train windows
+        workers: number of processes, cpu count if None
+        quiet: silence the per-bar output of the runs
+    Returns:
+        summary: frame with one row per window, best parameters, in and out of sample metrics
+        equity: out-of-sample equity curve indexed by date
+        metrics: metrics of the stitched out-of-sample curve
+    """
+    combos=grid(ranges)
+
+    # the runs only report metrics
+    config=dict(config)
+    for k in ['sweep','walkforward']:
+        config.pop(k,None)
+    config['chart']='false'
+    config.pop('submitUrl',None)
+    # _run reads the equity curve by bar position and the trades of every
+    # test window, so neither may be decimated or left out
+    for k in ['equity_points','exactbars']:
+        config.pop(k,None)
+    config['equity_curve']='true'
+    config['trade_list']='true'
+
+    path=tempfile.mkdtemp(prefix='walkforward')
+    try:
+        write_columnar(datafile,path)
+        dt=np.array(load_columns(path,'data')['dt'])
+        wins=windows(len(dt),train,test,anchored)
+        if not wins:
+            raise ValueError("%s bars are not enough for a train window of %s" % (len(dt),train))
+        print("[WALKFORWARD] %s %s windows (train %s, test %s bars) x %s combinations" %
+              (len(wins),'anchored' if anchored else 'rolling',train,test,len(combos)))
+
+        if workers is None:
+            workers=multiprocessing.cpu_count()
+        t=time.time()
+        pool=multiprocessing.Pool(workers,initializer=_init_worker,initargs=(strategy,config,path,quiet))
+        try:
+            # every window and combination at once, so all cores stay busy
+            tasks=[(a,b,params,None) for a,b,c in wins for params in combos]
+            insample=pool.map(_run,tasks)
+            best=[]
+            for i in range(len(wins)):
+                runs=insample[i*len(combos):(i+1)*len(combos)]
+                k=max(range(len(combos)),key=lambda j:_score(runs[j],objective))
+                best.append((combos[k],runs[k]))
+            outsample=pool.map(_run,[(a,c,params,b) for (a,b,c),(params,_) in zip(wins,best)])
+        finally:
+            pool.close()
+            pool.join()
+        elapsed=time.time()-t
+    finally:
+        shutil.rmtree(path,ignore_errors=True)
+    print("[WALKFORWARD] %s runs with %s workers in %.3fs" % (len(tasks)+len(wins),workers,elapsed))
+
+    # stitch the daily changes of the test windows onto the starting cash
+    changes=[]
+    trades=[]
+    rows=[]
+    for i,((a,b,c),(params,ins),oos) in enumerate(zip(wins,best,outsample)):
+        value=np.asarray(oos['value'])
+        changes.append(np.diff(np.concatenate([[oos['start']],value])))
+        trades+=oos['test_trades']
+        row={'window':i,'train_start':a,'test_start':b,'test_end':c}
+        row.update(params)
+        row.update({'is_'+k:ins[k] for k in METRICS})
+        row['oos_pnl']=float(value[-1]-oos['start'])
+        row['oos_trades']=len(oos['test_trades'])
+        rows.append(row)
+    start_value=outsample[0]['cash']
+    value=start_value+np.cumsum(np.concatenate(changes))
+    dates=(dt[wins[0][1]:wins[-1][2]]-EPOCH_ORDINAL).astype(np.int64).astype('datetime64[D]')
+    metrics=equity_metrics(value,dates,trades,start_value)
+
+    summary=pd.DataFrame(rows).set_index('window')
+    summary=summary[['train_start','test_start','test_end']+sorted(ranges)+['is_'+k for k in METRICS]+['oos_pnl','oos_trades']]
+    equity=pd.Series(value,index=pd.DatetimeIndex(dates),name='value')
+    return summary,equity,metrics
+
+def save(summary,equity,metrics,path=StrategyTemplate.MODEL_PATH):
+    """ Write walkforward.csv and walkforward_equity.csv and print the
+    out-of-sample metrics in the format of AlgoStrategy.performance """
+    summary.to_csv(os.path.join(path,'walkforward.csv'))
+    equity.to_csv(os.path.join(path,'walkforward_equity.csv'),header=True)
+    print(summary.to_string())
+    print('[WALKFORWARD OOS %s]' % json.dumps({k:v for k,v in metrics.items()}))
+    print('[SQN:%.2f, Sharpe Ratio:%.2f, Final Portfolio:%.2f, Total PnL:%.2f]' %
+          (metrics['sqn'] or 0,metrics['sharpe_ratio'],equity.iloc[-1],metrics['pnl']))
+
+def from_config(config):
+    """ Window settings of the walkforward config, a dict or its JSON string """
+    wf=config['walkforward']
+    if isinstance(wf,str):
+        wf=json.loads(wf)
+    anchored=wf.get('anchored',False)
+    if isinstance(anchored,str):
+        anchored=anchored.lower()=='true'
+    return int(wf.get('train',500)),int(wf.get('test',125)),anchored
+
+if __name__ == '__main__':
+    # python algo_walkforward.py <algo module> data.csv '{"train":500,"test":125}' '{"fast_period":"5:20:5",...}'
+    import importlib
+    cls=getattr(importlib.import_module(sys.argv[1]),'MyStrategy')
+    with open(StrategyTemplate.CONFIG_FILE, 'r') as f:
+        config=json.load(f)
+    config['walkforward']=sys.argv[3]
+    train,test,anchored=from_config(config)
+    summary,equity,metrics=run_walkforward(config,cls,sys.argv[2],parse_ranges(sys.argv[4]),train,test,anchored,
+                                           config.get('sweep_objective','pnl'))
+    save(summary,equity,metrics)
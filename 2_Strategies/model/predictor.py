@@ -7,14 +7,11 @@ from io import StringIO
 #import StringIO
 import flask
 
-import tensorflow as tf
 import numpy as np
-import pandas as pd
 
-from keras import backend as K
-from keras.models import load_model
-from sklearn.preprocessing import StandardScaler
-from sklearn.preprocessing import LabelEncoder, OneHotEncoder
+# dense networks with matching Keras outputs saved next to them run with
+# numpy, other models load Keras and TensorFlow when first used
+from algo_dense_model import load_model
 
 prefix = '/opt/ml/'
 model_path = os.path.join(prefix, 'model')
@@ -46,10 +43,8 @@ class ScoringService(object):
 
             There will be one prediction per row in the dataframe
         """
-        sess = K.get_session()
-        with sess.graph.as_default():
-            clf = cls.get_model()
-            return clf.predict(input)
+        clf = cls.get_model()
+        return clf.predict(input)
 
 # The flask app for serving predictions
 app = flask.Flask(__name__)
@@ -1,86 +1,284 @@
 import backtrader as bt
 import backtrader.feeds as btfeeds
 import backtrader.analyzers as btanalyzers
-import backtrader.plot
 import os
 import pytz
 from pytz import timezone
-import requests
 import json
+import tempfile
 import time
 from algo_sim_feed import AlgoSimData
+from algo_columnar_feed import AlgoColumnarData, load_portfolio
+from algo_results import open_store, save_arrays
+from algo_online import OnlineMetrics, RunningStats, sqn
+import algo_chart
 #from abc import classmethod
 
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-plt.rcParams["figure.figsize"] = [16,9]
-
 # More documentation about backtrader: https://www.backtrader.com/
 
+class SymbolTrades(bt.Analyzer):
+    """Running stats and number won of the closed trade PnLs of every data feed, by feed name"""
+    def notify_trade(self, trade):
+        if trade.isclosed:
+            stats,won=self.rets.get(trade.data._name) or (RunningStats(),0)
+            stats.add(trade.pnlcomm)
+            self.rets[trade.data._name]=(stats,won+(trade.pnlcomm>=0))
+
+class EquityCurve(bt.Analyzer):
+    """Broker value and close of the first feed at every bar, dt in backtrader day numbers
+    With max_points, every other point is dropped whenever 2*max_points are held,
+    so long runs keep between max_points and 2*max_points evenly spaced bars"""
+    params=(('max_points',None),)
+
+    def start(self):
+        self.dt=[]
+        self.value=[]
+        self.close=[]
+        self.bar=0
+        self.step=1
+        self.last=None
+
+    def next(self):
+        bar=self.bar
+        self.bar+=1
+        point=(self.strategy.datetime[0],self.strategy.broker.getvalue(),self.strategy.datas[0].close[0])
+        self.last=point
+        if bar%self.step:
+            return
+        self.dt.append(point[0])
+        self.value.append(point[1])
+        self.close.append(point[2])
+        if self.p.max_points and len(self.dt)>=2*self.p.max_points:
+            self.dt=self.dt[::2]
+            self.value=self.value[::2]
+            self.close=self.close[::2]
+            self.step*=2
+
+    def get_analysis(self):
+        if self.last is not None and self.step>1 and (self.bar-1)%self.step:
+            # the last bar is always part of the curve
+            return {'dt':self.dt+[self.last[0]],'value':self.value+[self.last[1]],'close':self.close+[self.last[2]]}
+        return {'dt':self.dt,'value':self.value,'close':self.close}
+
+class TradeList(bt.Analyzer):
+    """Every closed trade: symbol, open and close day numbers, side, entry price, bars, pnl"""
+    def start(self):
+        self.trades=[]
+
+    def notify_trade(self, trade):
+        if trade.isclosed:
+            self.trades.append({'symbol':trade.data._name,'opened':trade.dtopen,'closed':trade.dtclose,
+                                'long':trade.long,'price':trade.price,'bars':trade.barlen,'pnl':trade.pnlcomm})
+
+    def get_analysis(self):
+        return self.trades
+
+class OrderHistory(bt.Analyzer):
+    """Drops the finished orders and closed trades backtrader keeps for the
+    whole run, every `every` bars, so memory does not grow with the trades"""
+    params=(('every',1000),)
+
+    def start(self):
+        self.bar=0
+
+    def next(self):
+        self.bar+=1
+        if self.bar%self.p.every:
+            return
+        broker=self.strategy.broker
+        if hasattr(broker,'orders'):
+            broker.orders[:]=[o for o in broker.orders if o.alive()]
+        if hasattr(broker,'_pchildren'):
+            # BackBroker leaves the parent/children queue and the oco group
+            # leader of every finished order behind, oco cancels in the queue
+            for ref in [r for r,pc in broker._pchildren.items() if not any(o.alive() for o in pc)]:
+                del broker._pchildren[ref]
+            for ref in [r for r,leader in broker._ocos.items() if leader not in broker._ocol]:
+                del broker._ocos[ref]
+        # notified orders are only appended there
+        del self.strategy._orders[:]
+        for trades in self.strategy._trades.values():
+            for l in trades.values():
+                # new fills update the last trade of a data and tradeid
+                del l[:-1]
+
+# equity points kept by live and exactbars runs without equity_points
+EQUITY_POINTS = 5000
+
 class AlgoStrategy():
     
-    def __init__(self,config,strategy):
+    def __init__(self,config,strategy,data=None):
         self.config=config
         
-        self.cerebro = bt.Cerebro()        
+        # exactbars: 1 keeps only the bars the indicators need, for very long series
+        self.cerebro = bt.Cerebro(exactbars=int(config.get('exactbars',0)))
         strategy.config=config
         strategy.init_broker(self.cerebro.broker)
-        strategy.add_data(self.cerebro)
+        if data is not None:
+            self.cerebro.adddata(data)
+            # a tick feed serves its first interval, the others are feeds of
+            # their own built from the same ticks
+            aggregator=getattr(data,'aggregator',None)
+            if aggregator is not None:
+                for x in aggregator.intervals[1:]:
+                    self.cerebro.adddata(data.bars(x),name='%gs' % x)
+        else:
+            strategy.add_data(self.cerebro)
+        # the standard observers only feed backtrader's plot, which is not
+        # drawn for more symbols than chart_max_symbols, and their cost grows
+        # with the number of feeds times the number of orders
+        if len(self.cerebro.datas)>int(config.get('chart_max_symbols',4)):
+            self.cerebro.p.stdstats=False
         self.cerebro.addstrategy(strategy)
 
         self.portfolioStartValue=self.cerebro.broker.getvalue()
                             
-        self.cerebro.addanalyzer(btanalyzers.DrawDown, _name='dd')
-        self.cerebro.addanalyzer(btanalyzers.SharpeRatio_A, _name='sharpe')
-        self.cerebro.addanalyzer(btanalyzers.SQN, _name='sqn')
-        self.cerebro.addanalyzer(btanalyzers.TradeAnalyzer, _name='ta')
-        
-    def performance(self):
-        analyzer=self.thestrat.analyzers.ta.get_analysis()
-        dd_analyzer=self.thestrat.analyzers.dd.get_analysis()
-      
-        #Get the results we are interested in
-        total_open = analyzer.total.open
-        total_closed = analyzer.total.closed
-        total_won = analyzer.won.total
-        total_lost = analyzer.lost.total
-        win_streak = analyzer.streak.won.longest
-        lose_streak = analyzer.streak.lost.longest
-        pnl_net = round(analyzer.pnl.net.total,2)
-        strike_rate = (total_won / total_closed) * 100
-        #Designate the rows
-        h1 = ['Total Open', 'Total Closed', 'Total Won', 'Total Lost']
-        h2 = ['Strike Rate','Win Streak', 'Losing Streak', 'PnL Net']
-        h3 = ['DrawDown Pct','MoneyDown', '', '']
-        self.total_closed=total_closed
-        self.strike_rate=strike_rate
-        self.max_drawdown=dd_analyzer.max.drawdown
-        r1 = [total_open, total_closed,total_won,total_lost]
-        r2 = [('%.2f%%' %(strike_rate)), win_streak, lose_streak, pnl_net]
-        r3 = [('%.2f%%' %(dd_analyzer.max.drawdown)), dd_analyzer.max.moneydown, '', '']
-        #Check which set of headers is the longest.
-        header_length = max(len(h1),len(h2),len(h3))
-        #Print the rows
-        print_list = [h1,r1,h2,r2,h3,r3]
-        row_format ="{:<15}" * (header_length + 1)
-        print("Trade Analysis Results:")
-        for row in print_list:
-            print(row_format.format('',*row))
-
-        analyzer=self.thestrat.analyzers.sqn.get_analysis()
-        sharpe_analyzer=self.thestrat.analyzers.sharpe.get_analysis()
-        self.sqn = analyzer.sqn
-        self.sharpe_ratio = sharpe_analyzer['sharperatio']
+        # drawdown, Sharpe, SQN and trade stats in constant memory, readable
+        # during the run; metrics_every prints them every that many bars
+        self.cerebro.addanalyzer(OnlineMetrics, _name='online', every=int(config.get('metrics_every',0)))
+        self.cerebro.addanalyzer(SymbolTrades, _name='symbols')
+        # equity curve and trade list of the chart and the results store grow
+        # with every bar and trade, a live run never ends so it leaves them out,
+        # an exactbars run keeps a bounded equity curve and no trade list, and
+        # either keeps a bounded equity curve when it is asked for
+        live=any(d.islive() for d in self.cerebro.datas)
+        bounded=live or int(config.get('exactbars',0))>0
+        if config.get('equity_curve','false' if live else 'true')=='true':
+            points=config.get('equity_points',EQUITY_POINTS if bounded else None)
+            self.cerebro.addanalyzer(EquityCurve, _name='equity', max_points=int(points) if points else None)
+        if config.get('trade_list','false' if bounded else 'true')=='true':
+            self.cerebro.addanalyzer(TradeList, _name='trades')
+        if bounded:
+            self.cerebro.addanalyzer(OrderHistory, _name='orders')
+
+        # profile_bars: call counts and latency histograms of the phases of
+        # every bar, written next to chart.png; nothing is timed otherwise
+        self.profiler=None
+        if config.get('profile_bars','false')=='true':
+            from algo_profile import BarProfiler
+            self.profiler=BarProfiler()
+            self.profiler.instrument_cerebro(self.cerebro)
+
+    def metrics(self):
+        """Summary metrics of the run, with the same keys that are submitted"""
+        m=self.thestrat.analyzers.online.get_analysis()
+
+        self.total_closed=m['trades']
+        self.strike_rate=m['strike_rate']
+        self.max_drawdown=m['max_drawdown']
+        self.sqn = m['sqn']
+        self.sharpe_ratio = m['sharpe_ratio']
         if self.sharpe_ratio is None:
             self.sharpe_ratio=0
         self.pnl = self.cerebro.broker.getvalue()-self.portfolioStartValue
-        print('[SQN:%.2f, Sharpe Ratio:%.2f, Final Portfolio:%.2f, Total PnL:%.2f]' % (self.sqn,self.sharpe_ratio,self.cerebro.broker.getvalue(),self.pnl))
-        
-        # plot
-        fig=self.cerebro.plot()
-        plt.savefig(os.path.join(StrategyTemplate.MODEL_PATH, 'chart.png'))
-    
+        return {'trades': self.total_closed,
+                'strike_rate': self.strike_rate,
+                'max_drawdown': self.max_drawdown,
+                'pnl': self.pnl,
+                'sqn': self.sqn,
+                'sharpe_ratio': self.sharpe_ratio}
+
+    def analysis(self,name):
+        """get_analysis() of an analyzer, None if it is not attached"""
+        analyzer=getattr(self.thestrat.analyzers,name,None)
+        return analyzer.get_analysis() if analyzer is not None else None
+
+    def metrics_by_symbol(self):
+        """Trades, strike rate, SQN and PnL (closed trades plus the open
+        position at the last close) of every symbol of a portfolio run"""
+        closed=self.thestrat.analyzers.symbols.get_analysis()
+        res={}
+        for data in self.thestrat.datas:
+            stats,won=closed.get(data._name) or (RunningStats(),0)
+            n=stats.n
+            position=self.thestrat.getposition(data)
+            res[data._name]={'trades': n,
+                             'strike_rate': 100.0*won/n if n else 0,
+                             'sqn': sqn(stats),
+                             'pnl': stats.total+position.size*(data.close[0]-position.price)}
+        return res
+
+    def performance(self):
+        self.metrics()
+        analyzer=self.thestrat.analyzers.online.get_analysis()
+      
+        #Get the results we are interested in
+        if self.total_closed:
+            total_open = analyzer['open']
+            total_closed = analyzer['trades']
+            total_won = analyzer['won']
+            total_lost = analyzer['lost']
+            win_streak = analyzer['longest_won']
+            lose_streak = analyzer['longest_lost']
+            pnl_net = round(analyzer['net'],2)
+            strike_rate = self.strike_rate
+            #Designate the rows
+            h1 = ['Total Open', 'Total Closed', 'Total Won', 'Total Lost']
+            h2 = ['Strike Rate','Win Streak', 'Losing Streak', 'PnL Net']
+            h3 = ['DrawDown Pct','MoneyDown', '', '']
+            r1 = [total_open, total_closed,total_won,total_lost]
+            r2 = [('%.2f%%' %(strike_rate)), win_streak, lose_streak, pnl_net]
+            r3 = [('%.2f%%' %(analyzer['max_drawdown'])), analyzer['max_moneydown'], '', '']
+            #Check which set of headers is the longest.
+            header_length = max(len(h1),len(h2),len(h3))
+            #Print the rows
+            print_list = [h1,r1,h2,r2,h3,r3]
+            row_format ="{:<15}" * (header_length + 1)
+            print("Trade Analysis Results:")
+            for row in print_list:
+                print(row_format.format('',*row))
+        else:
+            print("Trade Analysis Results: no closed trades")
+
+        datas=self.thestrat.datas
+        if len(datas)>1:
+            print("Symbol Results:")
+            row_format ="{:<15}" * 5
+            print(row_format.format('Symbol','Trades','Strike Rate','SQN','PnL'))
+            for sym,m in self.metrics_by_symbol().items():
+                print(row_format.format(sym,m['trades'],'%.2f%%' % m['strike_rate'],'n/a' if m['sqn'] is None else '%.2f' % m['sqn'],'%.2f' % m['pnl']))
+
+        # sqn is None when every trade has the same PnL
+        print('[SQN:%s, Sharpe Ratio:%.2f, Final Portfolio:%.2f, Total PnL:%.2f]' % ('n/a' if self.sqn is None else '%.2f' % self.sqn,self.sharpe_ratio,self.cerebro.broker.getvalue(),self.pnl))
+
+    def chart(self):
+        # after the metrics are reported; chart: true (default), false or
+        # backtrader for the full plot of the feeds and indicators
+        chart=self.config.get('chart','true')
+        if chart=='false':
+            return
+        out=os.path.join(StrategyTemplate.MODEL_PATH, 'chart.png')
+        if chart=='backtrader':
+            # a plot of many symbols is not readable
+            datas=self.thestrat.datas
+            if len(datas)>int(self.config.get('chart_max_symbols',4)):
+                print("chart skipped for %s symbols" % len(datas))
+                return
+            if int(self.config.get('exactbars',0))>0:
+                print("chart skipped, backtrader does not plot with exactbars")
+                return
+            import matplotlib
+            matplotlib.use('Agg')
+            import matplotlib.pyplot as plt
+            plt.rcParams["figure.figsize"] = [16,9]
+            self.cerebro.plot()
+            plt.savefig(out)
+            return
+
+        # rendered in the background from the saved equity curve and trades
+        equity=self.analysis('equity')
+        if not equity:
+            print("chart skipped, no equity curve")
+            return
+        d=self.results_path
+        if d is None:
+            # not in MODEL_PATH, which is uploaded as the model artifact;
+            # the renderer removes it when done
+            d=tempfile.mkdtemp(prefix='chart_data')
+            save_arrays(d,equity,self.analysis('trades'))
+        algo_chart.start(d,out,int(self.config.get('chart_points',algo_chart.MAX_POINTS)),self.config.get('algo_name'),
+                         cleanup=d!=self.results_path)
+
     def submit(self):
         try:
             if 'submitUrl' in self.config:
@@ -91,14 +289,10 @@ class AlgoStrategy():
                 URL = submitUrl
                 ts=str(int(time.time()))       
                 PARAMS={'id': algo,
-                        'name': name,
-                        'trades': self.total_closed,
-                        'strike_rate': self.strike_rate,
-                        'max_drawdown': self.max_drawdown, 
-                        'pnl': self.pnl,
-                        'sqn': self.sqn,
-                        'sharpe_ratio': self.sharpe_ratio}
+                        'name': name}
+                PARAMS.update(self.metrics())
                 print("submit:%s" % (json.dumps(PARAMS)))
+                import requests
                 r = requests.get(url = URL, params = PARAMS, timeout=3) 
                 print("status=%s,res=%s" % (r.status_code,r.text))
                 if r.status_code == 200:
@@ -108,27 +302,58 @@ class AlgoStrategy():
         except Exception as e:
             print("error submitting performance:%s" % e)
         
+    def save_results(self):
+        # metrics, trades and equity curve in the results store, if configured
+        store=open_store(self.config,os.path.join(StrategyTemplate.MODEL_PATH,'results'))
+        self.results_path=None
+        if store is not None:
+            self.run_id=store.add_algo(self)
+            self.results_path=store.run_path(self.run_id)
+            print("[RESULTS] run %s saved to %s" % (self.run_id,store.path))
+
     def run(self):
+        t=time.time()
         thestrats = self.cerebro.run()
+        self.elapsed=time.time()-t
         self.thestrat = thestrats[0]
         self.performance()
+        if self.profiler is not None:
+            self.profiler.elapsed=self.elapsed
+            self.profiler.report(StrategyTemplate.MODEL_PATH)
+        self.save_results()
+        self.chart()
         self.submit()
 
 class StrategyTemplate(bt.Strategy):
 
     PREFIX='/opt/ml/'
     TRAIN_FILE = os.path.join(PREFIX,'input/data/training/data.csv')
+    COLUMNAR_PATH = os.path.join(PREFIX,'input/data/training/columnar')
     CONFIG_FILE = os.path.join(PREFIX,'input/config/hyperparameters.json')
     MODEL_PATH = os.path.join(PREFIX,'model')
+
+    # set by AlgoStrategy with profile_bars, times next() below
+    profiler = None
     
     def __init__(self):         
-        with open(StrategyTemplate.CONFIG_FILE, 'r') as f:
-            self.config = json.load(f)
-        print("[INIT]:config:%s=%s" % (StrategyTemplate.CONFIG_FILE,self.config))
+        # AlgoStrategy sets the config on the class, so runs with different
+        # parameters in one process do not read hyperparameters.json
+        config=getattr(type(self),'config',None)
+        if config is None:
+            with open(StrategyTemplate.CONFIG_FILE, 'r') as f:
+                config = json.load(f)
+            print("[INIT]:config:%s=%s" % (StrategyTemplate.CONFIG_FILE,config))
+        else:
+            print("[INIT]:config=%s" % config)
+        # copied, strategies convert the values in place
+        self.config=dict(config)
         
         self.lastDay=-1
         self.lastMonth=-1
         self.dataclose = self.datas[0].close
+        # portfolio runs: the feeds by symbol name
+        self.symbols = [d._name for d in self.datas]
+        self.data_by_symbol = dict(zip(self.symbols,self.datas))
     
     @staticmethod
     def init_broker(broker):
@@ -137,10 +362,43 @@ class StrategyTemplate(bt.Strategy):
     @staticmethod
     def add_data(cerebro):
         pass
+
+    @staticmethod
+    def add_columnar_data(cerebro,sym=None):
+        # memory-mapped alternative to GenericCSVData on TRAIN_FILE
+        data = AlgoColumnarData(StrategyTemplate.COLUMNAR_PATH,sym)
+        cerebro.adddata(data)
+        return data
+
+    @staticmethod
+    def add_portfolio_data(cerebro,symbols=None,path=None,verbose=False):
+        # one feed per symbol of the columnar store, on the dates all symbols
+        # have, named by symbol; symbols is a list or comma separated, all if
+        # None; verbose prints the symbols and bars loaded
+        if isinstance(symbols,str):
+            symbols=None if symbols=='all' else symbols.split(',')
+        columns=load_portfolio(path or StrategyTemplate.COLUMNAR_PATH,symbols,verbose)
+        datas=[]
+        for sym,c in columns.items():
+            data=AlgoColumnarData(None,sym,columns=c)
+            cerebro.adddata(data,name=sym)
+            datas.append(data)
+        if verbose:
+            print("[PORTFOLIO] %s symbols, %s bars" % (len(datas),datas[0].count if datas else 0))
+        return datas
+
+    def per_symbol(self,indicator,**kwargs):
+        """The indicator on the feed of every symbol, by symbol"""
+        return {sym:indicator(d,**kwargs) for sym,d in self.data_by_symbol.items()}
+
+    def position_of(self,sym):
+        return self.getposition(self.data_by_symbol[sym])
         
     def notify_order(self, order):
         dt=self.datas[0].datetime.datetime(0)
-       
+        if len(self.datas)>1:
+            dt='%s %s' % (dt,order.data._name)
+
         if order.status in [order.Completed]:
             if order.isbuy():
                 print(
@@ -151,6 +409,9 @@ class StrategyTemplate(bt.Strategy):
                          (dt,order.executed.price,order.executed.pnl,self.broker.getvalue()))
                 
     def next(self):
+        profiler=self.profiler
+        if profiler is not None:
+            t=time.perf_counter()
         dt=self.datas[0].datetime.datetime(0)
         #print("[NEXT]:%s:close=%s" % (dt,self.dataclose[0]))
         
@@ -166,3 +427,5 @@ class StrategyTemplate(bt.Strategy):
         if self.lastDay!=dt.day:
             self.lastDay=dt.day
             print("[%s] SOD:cash=%.2f" % (dt,self.broker.getvalue()))
+        if profiler is not None:
+            profiler.add('template',time.perf_counter()-t)
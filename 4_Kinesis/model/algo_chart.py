@@ -0,0 +1,126 @@
+import atexit
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# Chart of a run rendered after its metrics are reported, from the equity
+# curve and trades saved by algo_results.save_arrays, in a separate process
+# so the backtest does not wait for it. matplotlib is only imported by that
+# process. Long series are downsampled to max_points, keeping the highest
+# and lowest value of every bucket so peaks and drawdowns stay visible.
+#
+#   python algo_chart.py <run directory> chart.png [max_points] [title] [--cleanup]
+
+MAX_POINTS = 2000
+
+# day number of 1970-01-01 in backtrader's date2num convention
+EPOCH_ORDINAL = 719163
+
+# renderers still running, waited for at exit so the chart is complete
+_pending=[]
+
+def downsample(y,max_points=MAX_POINTS):
+    """ Indices of at most max_points points of y: the first and last, and
+    the minimum and maximum of equal buckets in between """
+    n=len(y)
+    if n<=max_points:
+        return np.arange(n)
+    buckets=max(1,(max_points-2)//2)
+    edges=np.linspace(1,n-1,buckets+1).astype(np.int64)
+    y=np.asarray(y)
+    idx=[0]
+    for a,b in zip(edges[:-1],edges[1:]):
+        if b>a:
+            seg=y[a:b]
+            lo=a+int(np.argmin(seg))
+            hi=a+int(np.argmax(seg))
+            idx+=[lo,hi] if lo<hi else [hi,lo]
+    idx.append(n-1)
+    return np.unique(idx)
+
+def render(d,out,max_points=MAX_POINTS,title=None):
+    """ Price with trade entries, equity and drawdown of the run saved in d """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from algo_results import load_equity, load_trades, to_datetime
+
+    t=time.time()
+    equity=load_equity(d)
+    value=np.asarray(equity['value'])
+    dt=np.asarray(equity['dt'])
+    peak=np.maximum.accumulate(value)
+    drawdown=100.0*(value-peak)/peak
+
+    panels=3 if 'close' in equity else 2
+    fig,axes=plt.subplots(panels,1,sharex=True,figsize=(16,9),gridspec_kw={'height_ratios':[3,2,1][-panels:]})
+    if title:
+        fig.suptitle(title)
+    ax=iter(axes)
+
+    if 'close' in equity:
+        a=next(ax)
+        close=np.asarray(equity['close'])
+        idx=downsample(close,max_points)
+        a.plot(to_datetime(dt[idx]),close[idx],color='black',linewidth=0.8,label='close')
+        if os.path.isdir(os.path.join(d,'trades')):
+            trades=load_trades(d)
+            # entries at their price, exits at the close of their bar
+            for long,color,marker in [(1.0,'green','^'),(0.0,'red','v')]:
+                sel=trades['long']==long
+                a.scatter(to_datetime(trades['opened'][sel]),trades['price'][sel],color=color,marker=marker,s=30,zorder=3)
+            at=np.clip(np.searchsorted(dt,trades['closed']),0,len(dt)-1)
+            a.scatter(to_datetime(trades['closed']),close[at],color='blue',marker='x',s=20,zorder=3)
+        a.set_ylabel('close')
+        a.grid(True)
+
+    a=next(ax)
+    idx=downsample(value,max_points)
+    a.plot(to_datetime(dt[idx]),value[idx],color='navy',linewidth=0.8)
+    a.set_ylabel('value')
+    a.grid(True)
+
+    a=next(ax)
+    idx=downsample(drawdown,max_points)
+    a.fill_between(to_datetime(dt[idx]),drawdown[idx],0,color='red',alpha=0.4)
+    a.set_ylabel('drawdown %')
+    a.grid(True)
+
+    fig.savefig(out)
+    plt.close(fig)
+    print("[CHART] %s from %s bars (%s plotted) in %.2fs" % (out,len(value),min(len(value),max_points),time.time()-t))
+
+def start(d,out,max_points=MAX_POINTS,title=None,cleanup=False):
+    """ Render in a background process, returns immediately; with cleanup
+    the process removes d when done """
+    args=[sys.executable,os.path.abspath(__file__),d,out,str(max_points)]
+    if title:
+        args.append(title)
+    if cleanup:
+        args.append('--cleanup')
+    env=dict(os.environ)
+    # the renderer imports algo_results from this directory
+    env['PYTHONPATH']=os.pathsep.join([os.path.dirname(os.path.abspath(__file__)),env.get('PYTHONPATH','')])
+    p=subprocess.Popen(args,env=env)
+    _pending.append(p)
+    return p
+
+def wait():
+    """ Wait for the background renderers """
+    while _pending:
+        _pending.pop().wait()
+
+atexit.register(wait)
+
+if __name__ == '__main__':
+    args=[x for x in sys.argv[1:] if x!='--cleanup']
+    try:
+        render(args[0],args[1],int(args[2]) if len(args)>2 else MAX_POINTS,
+               args[3] if len(args)>3 else None)
+    finally:
+        if '--cleanup' in sys.argv[1:]:
+            shutil.rmtree(args[0],ignore_errors=True)
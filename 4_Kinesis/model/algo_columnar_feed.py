@@ -0,0 +1,123 @@
+import datetime
+import json
+import os
+
+from backtrader.feed import DataBase
+from backtrader import date2num
+from backtrader import TimeFrame
+
+import numpy as np
+
+# Columnar store written by data_prep.py (save_stock_columnar):
+#   <path>/index.json            {"columns":[...],"symbols":{sym:{"count","start","end"}}}
+#   <path>/<sym>/<column>.npy    float64 arrays, dt holds backtrader day numbers
+
+COLUMNS = ['dt','open','high','low','close','vol']
+
+# day number of 1970-01-01 in backtrader's date2num convention
+EPOCH_ORDINAL = 719163
+
+def read_index(path):
+    with open(os.path.join(path,'index.json'), 'r') as f:
+        return json.load(f)
+
+def write_columnar(datafile,path,sym='data'):
+    """ Convert a daily data.csv (dt,open,high,low,close,vol) into a store
+    with one symbol, so it is parsed once and can be memory-mapped by many runs
+    """
+    # imported here, algo_base only needs the feed
+    import pandas as pd
+    df=pd.read_csv(datafile,parse_dates=['dt'])
+    d=os.path.join(path,sym)
+    os.makedirs(d,exist_ok=True)
+    dt=(df['dt'].values.astype('datetime64[D]').astype(np.int64)+EPOCH_ORDINAL).astype(np.float64)
+    np.save(os.path.join(d,'dt.npy'),dt)
+    for x in COLUMNS[1:]:
+        np.save(os.path.join(d,x+'.npy'),np.ascontiguousarray(df[x].values,dtype=np.float64))
+    index={'columns':COLUMNS,'symbols':{sym:{'count':len(df),
+        'start':df['dt'].iloc[0].strftime('%Y-%m-%d') if len(df) else None,
+        'end':df['dt'].iloc[-1].strftime('%Y-%m-%d') if len(df) else None}}}
+    with open(os.path.join(path,'index.json'), 'w') as f:
+        f.write(json.dumps(index))
+    return index
+
+def load_columns(path,sym):
+    """ Memory-mapped columns of a symbol, nothing is read until used """
+    d=os.path.join(path,sym)
+    return {x:np.load(os.path.join(d,x+'.npy'),mmap_mode='r') for x in COLUMNS}
+
+def load_portfolio(path,symbols=None,verbose=False):
+    """ Columns of many symbols on one calendar: the dates all symbols have
+    Args:
+        path: columnar store
+        symbols: symbols to load, all if None
+        verbose: print how many bars the symbols have in common
+    Returns:
+        columns: {sym: columns}, in symbol order
+    """
+    index=read_index(path)
+    if symbols is None:
+        symbols=sorted(index['symbols'])
+    cols={sym:load_columns(path,sym) for sym in symbols}
+    if not cols:
+        return cols
+    first=cols[symbols[0]]['dt']
+    if all(len(c['dt'])==len(first) and np.array_equal(c['dt'],first) for c in cols.values()):
+        # already aligned, stays memory-mapped
+        return cols
+    common=first
+    for c in cols.values():
+        common=np.intersect1d(common,c['dt'],assume_unique=True)
+    for sym,c in cols.items():
+        idx=np.searchsorted(c['dt'],common)
+        cols[sym]={x:np.ascontiguousarray(v[idx]) for x,v in c.items()}
+    if verbose:
+        print("[PORTFOLIO] %s symbols aligned on %s common bars" % (len(cols),len(common)))
+    return cols
+
+class AlgoColumnarData(DataBase):
+    def __init__(self,path,sym=None,columns=None):
+        super(AlgoColumnarData, self).__init__()
+        if columns is None:
+            self.index=read_index(path)
+            if sym is None:
+                sym=sorted(self.index['symbols'])[0]
+            c=load_columns(path,sym)
+        else:
+            # columns of load_portfolio, already aligned with the other symbols
+            c=columns
+        self.sym=sym
+        self.count=len(c['dt'])
+        self._dt=c['dt']
+        self._open=c['open']
+        self._high=c['high']
+        self._low=c['low']
+        self._close=c['close']
+        self._vol=c['vol']
+        self._eos=0.0
+        if columns is None:
+            print("ColumnarData:sym=%s,count=%s,from=%s,to=%s" % (sym,self.count,self.index['symbols'][sym]['start'],self.index['symbols'][sym]['end']))
+        self.n=0
+
+    def start(self):
+        super(AlgoColumnarData, self).start()
+        # daily bars are stamped at the end of the session like GenericCSVData
+        if self.p.timeframe>=TimeFrame.Days:
+            self._eos=date2num(datetime.datetime.combine(datetime.date.min,self.p.sessionend))-1.0
+        self.n=0
+
+    def _load(self):
+        n=self.n
+        if n>=self.count:
+            return False
+
+        self.lines.datetime[0] = self._dt[n]+self._eos
+        self.lines.open[0] = self._open[n]
+        self.lines.high[0] = self._high[n]
+        self.lines.low[0] = self._low[n]
+        self.lines.close[0] = self._close[n]
+        self.lines.volume[0] = self._vol[n]
+        self.lines.openinterest[0] = 0
+
+        self.n=n+1
+        return True
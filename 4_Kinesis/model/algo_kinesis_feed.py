@@ -0,0 +1,636 @@
+import bisect
+import hashlib
+import heapq
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import backtrader as bt
+from backtrader.feed import DataBase
+from backtrader import date2num
+import boto3
+import numpy as np
+import pandas as pd
+from dateutil import parser
+
+# Market data feed from a Kinesis stream (DMS records of the price table).
+# Every shard is read in its own thread and the records are merged in
+# timestamp order, so no data is lost on a multi-shard stream.
+# In streaming mode pages are read on demand as the backtest consumes bars,
+# and only a bounded window of pages per shard is held in memory.
+# With a replay cache the decoded bars are kept on local disk per symbol and
+# only records after the last cached sequence number are read from the stream.
+# Pages are decoded as a batch into columns: dt (datetime64[us]), sym (only
+# when all symbols are kept) and the float64 price columns.
+
+PAGE_LIMIT = 1000
+
+FIELDS = ['open','high','low','close','vol']
+
+# day number of 1970-01-01 in backtrader's date2num convention
+EPOCH_ORDINAL = 719163
+
+def list_shards(client,streamName):
+    """ Ids of all shards of the stream, following NextToken """
+    shards=[]
+    res=client.list_shards(StreamName=streamName)
+    while True:
+        shards+=[s['ShardId'] for s in res['Shards']]
+        if not res.get('NextToken'):
+            break
+        res=client.list_shards(NextToken=res['NextToken'])
+    return shards
+
+def decode(record,sym):
+    """ Bar dict of a DMS record for sym (any symbol if None), None for other
+    records. Reference for decode_page, which is used by the readers.
+    """
+    jdat=json.loads(record['Data'])
+    if 'data' not in jdat:
+        return None
+    data=jdat['data']
+    if sym is not None and data['sym']!=sym:
+        return None
+    data['dt']=parser.parse(data['dt'])
+    return data
+
+def parse_dates(values):
+    """ datetime64[us] array of timestamp strings, ISO formats are parsed by
+    numpy in one call, anything else falls back to dateutil
+    """
+    try:
+        return np.array(values,dtype='datetime64[us]')
+    except ValueError:
+        return np.array([parser.parse(x) for x in values],dtype='datetime64[us]')
+
+def empty_columns(with_sym=False):
+    cols={'dt':np.array([],dtype='datetime64[us]')}
+    if with_sym:
+        cols['sym']=np.array([],dtype=object)
+    for x in FIELDS:
+        cols[x]=np.array([],dtype=np.float64)
+    return cols
+
+def concat_columns(parts,with_sym=False):
+    """ Columns of the parts appended in order """
+    if not parts:
+        return empty_columns(with_sym)
+    return {x:np.concatenate([c[x] for c in parts]) for x in parts[0]}
+
+def take_columns(cols,idx):
+    return {x:v[idx] for x,v in cols.items()}
+
+def merge_columns(parts,with_sym=False):
+    """ Columns of the parts in timestamp order, ties keep the order of the parts """
+    cols=concat_columns(parts,with_sym)
+    return take_columns(cols,np.argsort(cols['dt'],kind='mergesort'))
+
+def decode_page(records,sym,by_key=False):
+    """ Columns of the DMS records of sym in a get_records page
+    Records of other symbols are dropped before they are parsed: by their
+    partition key if the stream is partitioned by symbol, else by a search
+    for the quoted symbol in the raw payload. The remaining payloads are
+    parsed with one json call.
+    Args:
+        records: get_records records
+        sym: symbol to keep, all if None
+        by_key: the partition key of a record is its symbol
+    """
+    if sym is None:
+        payloads=[o['Data'] for o in records]
+    elif by_key:
+        payloads=[o['Data'] for o in records if o['PartitionKey']==sym]
+    else:
+        needle=('"%s"' % sym).encode('utf-8')
+        payloads=[o['Data'] for o in records if needle in o['Data']]
+    if not payloads:
+        return empty_columns(sym is None)
+    l=json.loads(b'['+b','.join(payloads)+b']')
+    # the prefix check lets through records that only mention the symbol
+    l=[x['data'] for x in l if 'data' in x and (sym is None or x['data']['sym']==sym)]
+    cols={'dt':parse_dates([x['dt'] for x in l])}
+    if sym is None:
+        cols['sym']=np.array([x['sym'] for x in l],dtype=object)
+    for f in FIELDS:
+        cols[f]=np.array([x[f] for x in l],dtype=np.float64)
+    return cols
+
+def date_nums(dt):
+    """ backtrader day numbers of a datetime64 array """
+    return dt.astype('datetime64[us]').astype(np.int64)/86400e6+EPOCH_ORDINAL
+
+class ShardReader(object):
+    """ Reads one shard from TRIM_HORIZON, or after a sequence number, until
+    it has caught up
+    Args:
+        client: boto3 kinesis client
+        streamName: stream
+        shardId: shard
+        sym: symbol to keep, all if None
+        max_backoff: longest wait after a throttled read in seconds
+        after: sequence number to read after
+        by_key: the partition key of a record is its symbol
+    """
+    def __init__(self,client,streamName,shardId,sym,max_backoff=5.0,after=None,by_key=False):
+        self.client=client
+        self.streamName=streamName
+        self.shardId=shardId
+        self.sym=sym
+        self.max_backoff=max_backoff
+        self.after=after
+        self.by_key=by_key
+        # sequence range of the records read
+        self.first_seq=None
+        self.last_seq=None
+        self.stats={'records':0,'bars':0,'pages':0,'throttled':0,'seconds':0.0}
+
+    def pages(self):
+        """ Records of the shard, one list per get_records page """
+        if self.after is None:
+            it=self.client.get_shard_iterator(StreamName=self.streamName,ShardId=self.shardId,
+                                              ShardIteratorType='TRIM_HORIZON')['ShardIterator']
+        else:
+            it=self.client.get_shard_iterator(StreamName=self.streamName,ShardId=self.shardId,
+                                              ShardIteratorType='AFTER_SEQUENCE_NUMBER',
+                                              StartingSequenceNumber=self.after)['ShardIterator']
+        failures=0
+        while it is not None:
+            try:
+                out=self.client.get_records(ShardIterator=it,Limit=PAGE_LIMIT)
+            except Exception as e:
+                # each shard allows 5 reads/s, back off when throttled
+                if 'ProvisionedThroughputExceeded' not in type(e).__name__:
+                    raise
+                failures+=1
+                self.stats['throttled']+=1
+                time.sleep(min(self.max_backoff,0.2*2**failures))
+                continue
+            failures=0
+            self.stats['pages']+=1
+            self.stats['records']+=len(out['Records'])
+            if out['Records']:
+                if self.first_seq is None:
+                    self.first_seq=out['Records'][0]['SequenceNumber']
+                self.last_seq=out['Records'][-1]['SequenceNumber']
+            yield out['Records']
+            # a closed shard has no next iterator; a page without
+            # MillisBehindLatest is not taken as caught up unless it is empty
+            it=out.get('NextShardIterator')
+            behind=out.get('MillisBehindLatest')
+            if behind==0 or (behind is None and not out['Records']):
+                break
+
+    def read(self):
+        """ Columns of sym in the shard """
+        t=time.time()
+        parts=[decode_page(records,self.sym,self.by_key) for records in self.pages()]
+        cols=concat_columns(parts,self.sym is None)
+        self.stats['bars']=len(cols['dt'])
+        self.stats['seconds']=time.time()-t
+        return cols
+
+    def stream(self,window,stopped):
+        """ Bars of sym in the shard as (dt, open, high, low, close, vol)
+        tuples, dt in backtrader day numbers, read ahead by a thread
+        Args:
+            window: pages read ahead at most
+            stopped: Event that ends the read
+        """
+        q=queue.Queue(maxsize=window)
+        end=object()
+
+        def put(item):
+            # blocks while the window is full, the backtest sets the pace
+            while not stopped.is_set():
+                try:
+                    q.put(item,timeout=1.0)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def run():
+            t=time.time()
+            try:
+                for records in self.pages():
+                    cols=decode_page(records,self.sym,self.by_key)
+                    n=len(cols['dt'])
+                    self.stats['bars']+=n
+                    self.stats['seconds']=time.time()-t
+                    if n and not put(list(zip(date_nums(cols['dt']).tolist(),*[cols[x].tolist() for x in FIELDS]))):
+                        return
+                put(end)
+            except Exception as e:
+                put(e)
+
+        thread=threading.Thread(target=run,name=self.shardId)
+        thread.daemon=True
+        thread.start()
+        while True:
+            item=q.get()
+            if item is end:
+                return
+            if isinstance(item,Exception):
+                raise item
+            for x in item:
+                yield x
+
+def read_stream(client,streamName,sym,workers=None,by_key=False):
+    """ Bars of sym from all shards of the stream, in timestamp order
+    Args:
+        client: boto3 kinesis client
+        streamName: stream
+        sym: symbol
+        workers: threads, one per shard if None
+        by_key: the partition key of a record is its symbol
+    Returns:
+        bars: columns
+        stats: per shard read statistics
+    """
+    readers=[ShardReader(client,streamName,s,sym,by_key=by_key) for s in list_shards(client,streamName)]
+    t=time.time()
+    with ThreadPoolExecutor(max_workers=workers or max(1,len(readers))) as pool:
+        parts=list(pool.map(lambda r:r.read(),readers))
+    elapsed=time.time()-t
+    # records of one partition key are ordered within their shard
+    bars=merge_columns(parts)
+
+    stats={}
+    for r in readers:
+        s=dict(r.stats)
+        s['records_per_s']=s['records']/s['seconds'] if s['seconds'] else 0.0
+        stats[r.shardId]=s
+        print("[KINESIS] %s: %s records, %s bars, %s pages, %s throttled, %.0f records/s" %
+              (r.shardId,s['records'],s['bars'],s['pages'],s['throttled'],s['records_per_s']))
+    print("[KINESIS] %s bars of %s from %s shards in %.3fs" % (len(bars['dt']),sym,len(readers),elapsed))
+    return bars,stats
+
+def stream_bars(client,streamName,sym,window=10,stopped=None,by_key=False):
+    """ Bars of sym from all shards of the stream in timestamp order, read
+    on demand with at most window pages per shard in memory
+    Args:
+        client: boto3 kinesis client
+        streamName: stream
+        sym: symbol
+        window: pages read ahead per shard
+        stopped: Event that ends the reader threads
+        by_key: the partition key of a record is its symbol
+    Returns:
+        bars: generator of (dt, open, high, low, close, vol) tuples
+        readers: ShardReader per shard, for the statistics
+    """
+    if stopped is None:
+        stopped=threading.Event()
+    readers=[ShardReader(client,streamName,s,sym,by_key=by_key) for s in list_shards(client,streamName)]
+    streams=[r.stream(window,stopped) for r in readers]
+    return heapq.merge(*streams),readers
+
+class ReplayCache(object):
+    """ Decoded bars of a stream on local disk, keyed by shard and sequence range
+      <path>/<stream>/index.json                 {"shards":{shardId:{"last":seq,"segments":[[first,last],...]}}}
+      <path>/<stream>/<shardId>/<first>-<last>/<sym>/<column>.npy
+    dt is datetime64[us], the price columns are float64.
+    Args:
+        path: cache directory
+        streamName: stream
+    """
+    def __init__(self,path,streamName):
+        self.path=os.path.join(path,streamName)
+        self.indexFile=os.path.join(self.path,'index.json')
+        self.index={'shards':{}}
+        if os.path.exists(self.indexFile):
+            with open(self.indexFile, 'r') as f:
+                self.index=json.load(f)
+
+    def last(self,shardId):
+        """ Last cached sequence number of the shard, None if not cached """
+        return self.index['shards'].get(shardId,{}).get('last')
+
+    def add_segment(self,shardId,first,last,cols):
+        """ Store the columns (with sym) of the records first..last of a shard """
+        d=os.path.join(self.path,shardId,'%s-%s' % (first,last))
+        for stk in np.unique(cols['sym']):
+            mask=cols['sym']==stk
+            sd=os.path.join(d,stk)
+            os.makedirs(sd,exist_ok=True)
+            for x in ['dt']+FIELDS:
+                np.save(os.path.join(sd,x+'.npy'),cols[x][mask])
+        shard=self.index['shards'].setdefault(shardId,{'last':None,'segments':[]})
+        shard['segments'].append([first,last])
+        shard['last']=last
+
+    def save(self):
+        os.makedirs(self.path,exist_ok=True)
+        tmp='%s.%s' % (self.indexFile,os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(self.index))
+        os.rename(tmp,self.indexFile)
+
+    def read(self,sym):
+        """ Cached columns of sym from all shards in timestamp order """
+        parts=[]
+        for shardId,shard in sorted(self.index['shards'].items()):
+            for first,last in shard['segments']:
+                sd=os.path.join(self.path,shardId,'%s-%s' % (first,last),sym)
+                if os.path.isdir(sd):
+                    parts.append({x:np.load(os.path.join(sd,x+'.npy')) for x in ['dt']+FIELDS})
+        return merge_columns(parts)
+
+def read_cached(client,streamName,sym,path,workers=None):
+    """ Bars of sym from the replay cache, updated first with the records of
+    every shard after its last cached sequence number
+    Args:
+        client: boto3 kinesis client
+        streamName: stream
+        sym: symbol
+        path: cache directory
+        workers: threads, one per shard if None
+    Returns:
+        bars: columns in timestamp order
+        stats: per shard read statistics
+    """
+    cache=ReplayCache(path,streamName)
+    readers=[ShardReader(client,streamName,s,None,after=cache.last(s)) for s in list_shards(client,streamName)]
+    t=time.time()
+    with ThreadPoolExecutor(max_workers=workers or max(1,len(readers))) as pool:
+        parts=list(pool.map(lambda r:r.read(),readers))
+    elapsed=time.time()-t
+
+    stats={}
+    try:
+        for r,cols in zip(readers,parts):
+            if r.last_seq is not None:
+                cache.add_segment(r.shardId,r.first_seq,r.last_seq,cols)
+        cache.save()
+    except OSError as e:
+        # a read-only cache still serves what it has
+        print("[KINESIS] cache not updated:%s" % e)
+        cache=None
+    for r in readers:
+        s=dict(r.stats)
+        s['records_per_s']=s['records']/s['seconds'] if s['seconds'] else 0.0
+        s['cached_until']=r.after
+        stats[r.shardId]=s
+        print("[KINESIS] %s: %s new records after %s, %s pages, %.0f records/s" %
+              (r.shardId,s['records'],r.after,s['pages'],s['records_per_s']))
+    if cache is None:
+        new=[take_columns(c,c['sym']==sym) for c in parts]
+        for c in new:
+            del c['sym']
+        bars=merge_columns([ReplayCache(path,streamName).read(sym)]+new)
+    else:
+        bars=cache.read(sym)
+    print("[KINESIS] %s bars of %s, stream read in %.3fs" % (len(bars['dt']),sym,elapsed))
+    return bars,stats
+
+class KinesisFeed(DataBase):
+    """ Backtest feed of one symbol of the Kinesis stream
+    Bars before split are the training data, the rest the test data. Without
+    split the first 70% of the bars are the training data, which needs the
+    whole stream in memory, so streaming mode needs a split.
+    Args:
+        region: AWS region
+        streamName: stream
+        sym: symbol
+        test_data: serve the test data (after the split) instead of the
+            training data; the notebook feed served the training data either way
+        client: kinesis client, a boto3 client if None
+        streaming: read pages as bars are consumed instead of upfront
+        split: first timestamp of the test data
+        window: pages read ahead per shard in streaming mode
+        cache: replay cache directory, only new records are read from the
+            stream, not used in streaming mode
+        by_key: the partition key of a record is its symbol
+    """
+    def __init__(self,region,streamName,sym,test_data=False,client=None,streaming=False,split=None,window=10,cache=None,by_key=False):
+        super(KinesisFeed, self).__init__()
+        if client is None:
+            client=boto3.client('kinesis',region_name=region)
+        if streaming and split is None:
+            raise ValueError("streaming mode needs a split timestamp")
+        if streaming and cache is not None:
+            raise ValueError("the replay cache is not used in streaming mode")
+        self.client=client
+        self.streamName=streamName
+        self.sym=sym
+        self.test_data=test_data
+        self.streaming=streaming
+        self.split=parser.parse(split) if isinstance(split,str) else split
+        self.window=window
+        self.by_key=by_key
+        self.timeframe=bt.TimeFrame.Days
+        self.n=0
+
+        if streaming:
+            self._split=date2num(self.split)
+            print("streaming %s, %s data split at %s" % (sym,'test' if test_data else 'training',self.split))
+            return
+
+        if cache is not None:
+            cols,self.shard_stats=read_cached(client,streamName,sym,cache)
+        else:
+            cols,self.shard_stats=read_stream(client,streamName,sym,by_key=by_key)
+        if self.split is None:
+            trainCount=int(len(cols['dt'])*0.7)
+        else:
+            trainCount=int(np.searchsorted(cols['dt'],np.datetime64(self.split,'us')))
+        if test_data:
+            cols=take_columns(cols,slice(trainCount,None))
+        else:
+            cols=take_columns(cols,slice(None,trainCount))
+        self.count=len(cols['dt'])
+        self._dt=date_nums(cols['dt'])
+        self._open=cols['open']
+        self._high=cols['high']
+        self._low=cols['low']
+        self._close=cols['close']
+        self._vol=cols['vol']
+
+        if not self.count:
+            # the run ends at once instead of failing here
+            self.fromdate=self.todate=None
+            print("no %s bars of %s" % ('test' if test_data else 'training',sym))
+            return
+        self.fromdate=cols['dt'][0].astype(object)
+        self.todate=cols['dt'][-1].astype(object)
+        print("from=%s,to=%s" % (self.fromdate,self.todate))
+
+    def start(self):
+        if self.streaming:
+            self._stopped=threading.Event()
+            self.bars,self.readers=stream_bars(self.client,self.streamName,self.sym,self.window,self._stopped,self.by_key)
+
+    def stop(self):
+        if self.streaming:
+            self._stopped.set()
+            self.shard_stats={r.shardId:dict(r.stats) for r in self.readers}
+
+    def _next_bar(self):
+        if not self.streaming:
+            n=self.n
+            if n>=self.count:
+                return None
+            return (self._dt[n],self._open[n],self._high[n],self._low[n],self._close[n],self._vol[n])
+        for r in self.bars:
+            if r[0]<self._split:
+                if self.test_data:
+                    continue
+                return r
+            # past the split the training data ends without reading further
+            return r if self.test_data else None
+        return None
+
+    def _load(self):
+        r=self._next_bar()
+        if r is None:
+            return False
+
+        self.lines.datetime[0] = r[0]
+
+        self.lines.open[0] = r[1]
+        self.lines.high[0] = r[2]
+        self.lines.low[0] = r[3]
+        self.lines.close[0] = r[4]
+        self.lines.volume[0] = r[5]
+
+        self.n=self.n+1
+        return True
+
+class ProvisionedThroughputExceededException(Exception):
+    pass
+
+class LocalKinesis(object):
+    """ In-process stand-in for the kinesis client, so the feed can be tested
+    and benchmarked offline. Records are spread over the shards by the MD5 of
+    their partition key like Kinesis does.
+    Args:
+        shards: number of shards
+        read_limit: get_records calls per second and shard, unlimited if None
+    """
+    def __init__(self,shards=4,read_limit=None):
+        self.shards=['shardId-%012d' % i for i in range(shards)]
+        self.records={s:[] for s in self.shards}
+        self.read_limit=read_limit
+        self._reads={s:[] for s in self.shards}
+        self._lock=threading.Lock()
+        self.seq=0
+
+    @staticmethod
+    def from_csv(datafiles,shards=4,**kwargs):
+        """ Stream of the DMS records of the rows of the csvs ({sym}.csv, dt first) """
+        stream=LocalKinesis(shards,**kwargs)
+        rows=[]
+        for f in datafiles:
+            df=pd.read_csv(f)
+            rows+=df.to_dict('records')
+        for r in sorted(rows,key=lambda x:x['dt']):
+            stream.put_record(r,r['sym'])
+        return stream
+
+    def shard_of(self,partitionKey):
+        h=int(hashlib.md5(partitionKey.encode('utf-8')).hexdigest(),16)
+        return self.shards[h*len(self.shards)>>128]
+
+    def put_record(self,data,partitionKey):
+        self.seq+=1
+        rec={'SequenceNumber':str(self.seq),'PartitionKey':partitionKey,
+             'Data':json.dumps({'data':data,'metadata':{'operation':'load'}}).encode('utf-8')}
+        self.records[self.shard_of(partitionKey)].append(rec)
+
+    def list_shards(self,StreamName=None,NextToken=None):
+        return {'Shards':[{'ShardId':s} for s in self.shards]}
+
+    def describe_stream(self,StreamName):
+        return {'StreamDescription':{'StreamName':StreamName,'Shards':[{'ShardId':s} for s in self.shards]}}
+
+    def get_shard_iterator(self,StreamName,ShardId,ShardIteratorType,StartingSequenceNumber=None):
+        pos=0
+        if ShardIteratorType=='AFTER_SEQUENCE_NUMBER':
+            seqs=[int(x['SequenceNumber']) for x in self.records[ShardId]]
+            pos=bisect.bisect_right(seqs,int(StartingSequenceNumber))
+        return {'ShardIterator':'%s:%s' % (ShardId,pos)}
+
+    def get_records(self,ShardIterator,Limit=10000):
+        shard,pos=ShardIterator.rsplit(':',1)
+        pos=int(pos)
+        if self.read_limit is not None:
+            with self._lock:
+                now=time.time()
+                reads=[t for t in self._reads[shard] if now-t<1.0]
+                if len(reads)>=self.read_limit:
+                    raise ProvisionedThroughputExceededException("Rate exceeded for shard %s" % shard)
+                self._reads[shard]=reads+[now]
+        records=self.records[shard]
+        end=min(len(records),pos+Limit)
+        return {'Records':records[pos:end],
+                'NextShardIterator':'%s:%s' % (shard,end),
+                'MillisBehindLatest':0 if end>=len(records) else 1000}
+
+    @staticmethod
+    def synthetic(symbols=50,days=2000,shards=4,**kwargs):
+        """ Stream of random walk DMS records of many symbols, partitioned by symbol """
+        stream=LocalKinesis(shards,**kwargs)
+        rng=np.random.RandomState(0)
+        names=['S%03d' % i for i in range(symbols)]
+        dates=pd.date_range('2012-01-02',periods=days,freq='B').strftime('%Y-%m-%d %H:%M:%S')
+        close=100*np.exp(np.cumsum(rng.normal(0,0.01,(days,symbols)),axis=0))
+        for i,d in enumerate(dates):
+            for j,stk in enumerate(names):
+                c=round(float(close[i,j]),2)
+                stream.put_record({'dt':d,'sym':stk,'open':c,'high':c,'low':c,'close':c,'vol':1000.0},stk)
+        return stream
+
+def benchmark_decode(symbols=50,days=2000):
+    """ Records/second of the per-record decode against decode_page with the
+    payload prefix check and with the partition key filter, for one symbol
+    of a synthetic multi-symbol stream
+    """
+    stream=LocalKinesis.synthetic(symbols,days,shards=1)
+    pages=[]
+    for records in ShardReader(stream,'local',stream.shards[0],None).pages():
+        pages.append(records)
+    n=sum(len(p) for p in pages)
+    sym='S000'
+
+    t=time.time()
+    ref=[x for p in pages for x in (decode(o,sym) for o in p) if x is not None]
+    t0=time.time()-t
+    res={'per_record':n/t0}
+    for name,by_key in [('prefix',False),('partition_key',True)]:
+        t=time.time()
+        cols=concat_columns([decode_page(p,sym,by_key) for p in pages])
+        t1=time.time()-t
+        assert len(cols['dt'])==len(ref)
+        assert np.array_equal(cols['close'],[x['close'] for x in ref])
+        assert np.array_equal(cols['dt'],np.array([x['dt'] for x in ref],dtype='datetime64[us]'))
+        res[name]=n/t1
+    print("[BENCH] %s records, %s symbols: per record %.0f records/s, batch prefix check %.0f records/s (%.1fx), batch partition key %.0f records/s (%.1fx)" %
+          (n,symbols,res['per_record'],res['prefix'],res['prefix']/res['per_record'],res['partition_key'],res['partition_key']/res['per_record']))
+    return res
+
+def benchmark(datafiles,sym,shards=4):
+    """ Bars/second of the parallel reader against the single shard read of
+    the original feed, on a local stream
+    """
+    stream=LocalKinesis.from_csv(datafiles,shards)
+    t=time.time()
+    reader=ShardReader(stream,'local',list_shards(stream,'local')[0],sym)
+    single=reader.read()
+    t1=time.time()-t
+    t=time.time()
+    bars,stats=read_stream(stream,'local',sym)
+    t2=time.time()-t
+    print("[BENCH] first shard only: %s bars in %.3fs, all shards: %s bars in %.3fs" % (len(single['dt']),t1,len(bars['dt']),t2))
+    return bars,stats
+
+if __name__ == '__main__':
+    # python algo_kinesis_feed.py decode [symbols] [days]
+    # python algo_kinesis_feed.py <sym> <csv>...
+    import sys
+    if sys.argv[1]=='decode':
+        benchmark_decode(*[int(x) for x in sys.argv[2:]])
+    else:
+        benchmark(sys.argv[2:],sys.argv[1])
@@ -0,0 +1,128 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import backtrader as bt
+import numpy as np
+
+from algo_base import AlgoStrategy, StrategyTemplate
+from algo_columnar_feed import COLUMNS, EPOCH_ORDINAL
+
+# Portfolio backtests: one AlgoStrategy run over many symbols of a columnar
+# store. StrategyTemplate.add_portfolio_data() adds one memory-mapped feed
+# per symbol on the dates all symbols have, strategies get their indicators
+# and positions by symbol (per_symbol, position_of) and AlgoStrategy reports
+# the portfolio metrics and the metrics of every symbol.
+#
+#   python algo_portfolio.py <columnar path> [AAPL,INTC,...]
+#   python algo_portfolio.py bench [symbol counts ...]
+
+class PortfolioSMA(StrategyTemplate):
+    """ SMA crossover on every symbol, size shares per symbol
+    hyperparameters: fast_period, slow_period, size, symbols ("all" or "AAPL,INTC")
+    """
+    # columnar store, StrategyTemplate.COLUMNAR_PATH if None
+    store=None
+    # print what add_data loaded
+    verbose=True
+
+    def __init__(self):
+        super(PortfolioSMA, self).__init__()
+        self.config["fast_period"]=int(self.config["fast_period"])
+        self.config["slow_period"]=int(self.config["slow_period"])
+        self.config["size"]=int(self.config["size"])
+        self.smaFast=self.per_symbol(bt.ind.SimpleMovingAverage,period=self.config["fast_period"])
+        self.smaSlow=self.per_symbol(bt.ind.SimpleMovingAverage,period=self.config["slow_period"])
+        self.size=self.config["size"]
+
+    @staticmethod
+    def init_broker(broker):
+        broker.setcash(100000.0)
+        broker.setcommission(commission=0.0)
+
+    @staticmethod
+    def add_data(cerebro):
+        StrategyTemplate.add_portfolio_data(cerebro,PortfolioSMA.config.get('symbols'),PortfolioSMA.store,PortfolioSMA.verbose)
+
+    def next(self):
+        super(PortfolioSMA, self).next()
+        for sym,data in self.data_by_symbol.items():
+            fast=self.smaFast[sym][0]
+            slow=self.smaSlow[sym][0]
+            size=self.position_of(sym).size
+            if size==0:
+                if fast>slow:
+                    self.buy(data=data,size=self.size)
+                else:
+                    self.sell(data=data,size=self.size)
+            elif size>0 and fast<slow:
+                self.sell(data=data,size=2*self.size)
+            elif size<0 and fast>slow:
+                self.buy(data=data,size=2*self.size)
+
+def synthetic_store(path,count,bars=1000,seed=0):
+    """ Columnar store of count random walk symbols S0..Sn on one calendar """
+    rng=np.random.RandomState(seed)
+    dt=(np.arange(bars)+np.datetime64('2015-01-01','D').astype(np.int64)+EPOCH_ORDINAL).astype(np.float64)
+    index={'columns':COLUMNS,'symbols':{}}
+    for i in range(count):
+        sym='S%s' % i
+        close=100.0*np.exp(np.cumsum(rng.normal(0,0.015,bars)))
+        open_=np.concatenate([[100.0],close[:-1]])
+        cols={'dt':dt,'open':open_,'high':np.maximum(open_,close)*1.005,'low':np.minimum(open_,close)*0.995,
+              'close':close,'vol':rng.randint(1000,100000,bars).astype(np.float64)}
+        d=os.path.join(path,sym)
+        os.makedirs(d,exist_ok=True)
+        for x in COLUMNS:
+            np.save(os.path.join(d,x+'.npy'),cols[x])
+        index['symbols'][sym]={'count':bars,'start':'2015-01-01','end':None}
+    with open(os.path.join(path,'index.json'), 'w') as f:
+        f.write(json.dumps(index))
+    return path
+
+def run(path,symbols=None,params=None,quiet=False):
+    """ PortfolioSMA on the symbols of a columnar store
+    Returns:
+        algo: the finished AlgoStrategy
+    """
+    config={'fast_period':10,'slow_period':50,'size':100,'chart':'false','symbols':symbols or 'all'}
+    config.update(params or {})
+    PortfolioSMA.store=path
+    PortfolioSMA.verbose=not quiet
+    algo=AlgoStrategy(config,PortfolioSMA)
+    if quiet:
+        with contextlib.redirect_stdout(io.StringIO()):
+            algo.run()
+    else:
+        algo.run()
+    return algo
+
+def benchmark(counts=(1,10,50,100,250,500),bars=1000):
+    """ Bars/second of a portfolio run as the number of symbols grows """
+    path=tempfile.mkdtemp(prefix='portfolio')
+    try:
+        synthetic_store(path,max(counts),bars)
+        rates=[]
+        for n in counts:
+            symbols=['S%s' % i for i in range(n)]
+            t=time.time()
+            algo=run(path,symbols,quiet=True)
+            elapsed=time.time()-t
+            m=algo.metrics()
+            rates.append(n*bars/elapsed)
+            print("[BENCH] %s symbols x %s bars: %.2fs, %.0f bars/s, %s trades, pnl %.2f" %
+                  (n,bars,elapsed,n*bars/elapsed,m['trades'],m['pnl']))
+        return rates
+    finally:
+        shutil.rmtree(path,ignore_errors=True)
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv)>1 and sys.argv[1]=='bench':
+        benchmark([int(x) for x in sys.argv[2:]] or (1,10,50,100,250,500))
+    else:
+        algo=run(sys.argv[1],sys.argv[2] if len(sys.argv)>2 else None)
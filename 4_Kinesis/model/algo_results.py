@@ -0,0 +1,272 @@
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+# Results store of backtest runs, so runs can be ranked, filtered and compared
+# without running them again or parsing their output:
+#   <path>/runs.db                       runs (metadata, config, metrics) and params tables
+#   <path>/<run_id>/equity/<col>.npy     dt (backtrader day numbers), value, close
+#   <path>/<run_id>/trades/<col>.npy     opened, closed, long, price, bars, pnl
+#   <path>/<run_id>/trades/symbols.json  symbol of every trade
+#
+# AlgoStrategy.run() adds its run when the hyperparameters have
+# "results_store" (a path, or "true" for <model>/results). Runs of the
+# workers of a sweep are added concurrently, SQLite serializes the writes.
+#
+#   python algo_results.py <path> [order by] [where]
+#   python algo_results.py bench
+#
+# pandas is only imported by the query functions, AlgoStrategy imports this
+# module on every run.
+
+METRICS = ['trades','strike_rate','max_drawdown','pnl','sqn','sharpe_ratio']
+RUN_COLUMNS = ['run_id','created','start','end','bars','elapsed']+METRICS
+TRADE_COLUMNS = ['opened','closed','long','price','bars','pnl']
+
+# day number of 1970-01-01 in backtrader's date2num convention
+EPOCH_ORDINAL = 719163
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL, algo TEXT, strategy TEXT, config TEXT,
+    start REAL, end REAL, bars INTEGER, elapsed REAL,
+    trades INTEGER, strike_rate REAL, max_drawdown REAL, pnl REAL, sqn REAL, sharpe_ratio REAL);
+CREATE TABLE IF NOT EXISTS params (run_id INTEGER, name TEXT, value);
+CREATE INDEX IF NOT EXISTS runs_pnl ON runs(pnl);
+CREATE INDEX IF NOT EXISTS runs_sharpe ON runs(sharpe_ratio);
+CREATE INDEX IF NOT EXISTS runs_sqn ON runs(sqn);
+CREATE INDEX IF NOT EXISTS runs_algo ON runs(algo);
+CREATE INDEX IF NOT EXISTS params_name_value ON params(name,value);
+CREATE INDEX IF NOT EXISTS params_run ON params(run_id);
+"""
+
+def to_value(x):
+    """ Hyperparameters are strings, numbers are stored as numbers so they
+    can be compared and ranged """
+    if isinstance(x,bool) or x is None:
+        return json.dumps(x)
+    if isinstance(x,(int,float)):
+        return x
+    if isinstance(x,str):
+        try:
+            return int(x)
+        except ValueError:
+            pass
+        try:
+            return float(x)
+        except ValueError:
+            return x
+    return json.dumps(x)
+
+def to_datetime(dt):
+    """ Datetimes of backtrader day numbers, to the microsecond like num2date,
+    daily bars are stamped at the session end 23:59:59.999990 """
+    import pandas as pd
+    return pd.to_datetime((np.asarray(dt,dtype=np.float64)-EPOCH_ORDINAL)*86400.0,unit='s').round('us')
+
+class ResultsStore(object):
+    """ Runs of many backtests in one directory
+    Args:
+        path: store directory, created if missing
+    """
+    def __init__(self,path):
+        self.path=path
+        os.makedirs(path,exist_ok=True)
+        db=self._connect()
+        try:
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self):
+        # concurrent writers wait for the lock instead of failing
+        return sqlite3.connect(os.path.join(self.path,'runs.db'),timeout=60)
+
+    def add(self,config,metrics,equity=None,trades=None,strategy=None,elapsed=None):
+        """ Add one run
+        Args:
+            config: hyperparameters of the run
+            metrics: AlgoStrategy.metrics()
+            equity: {'dt':[...],'value':[...]} of the EquityCurve analyzer
+            trades: list of dicts of the TradeList analyzer
+            strategy: strategy class name
+            elapsed: run time in seconds
+        Returns:
+            run_id
+        """
+        dt=equity['dt'] if equity else []
+        row=(time.time(),config.get('algo_name'),strategy,json.dumps(config,default=str),
+             dt[0] if len(dt) else None,dt[-1] if len(dt) else None,len(dt),elapsed)+tuple(metrics.get(k) for k in METRICS)
+        db=self._connect()
+        try:
+            with db:
+                cur=db.execute("INSERT INTO runs (created,algo,strategy,config,start,end,bars,elapsed,%s) VALUES (%s)" %
+                               (','.join(METRICS),','.join(['?']*(8+len(METRICS)))),row)
+                run_id=cur.lastrowid
+                db.executemany("INSERT INTO params VALUES (?,?,?)",
+                               [(run_id,k,to_value(v)) for k,v in sorted(config.items())])
+        finally:
+            db.close()
+
+        save_arrays(self.run_path(run_id),equity,trades)
+        return run_id
+
+    def run_path(self,run_id):
+        """ Directory of the equity and trades arrays of a run """
+        return os.path.join(self.path,str(run_id))
+
+    def add_algo(self,algo):
+        """ Add a finished AlgoStrategy run """
+        return self.add(algo.config,algo.metrics(),algo.analysis('equity'),algo.analysis('trades'),
+                        type(algo.thestrat).__name__,getattr(algo,'elapsed',None))
+
+    def query(self,where=None,order_by='pnl',ascending=False,limit=None,params=None,args=()):
+        """ Runs with their metrics and parameters
+        Args:
+            where: SQL condition on the runs columns, e.g. "sharpe_ratio>0 AND trades>=10"
+            order_by: runs column to rank by
+            ascending: rank order
+            limit: number of runs
+            params: {name: value or (low, high)} conditions on the hyperparameters
+            args: values of the ? placeholders of where
+        Returns:
+            runs: frame indexed by run_id, metrics then one column per parameter
+        """
+        if order_by and order_by not in RUN_COLUMNS:
+            raise ValueError("cannot order by %s, one of %s" % (order_by,RUN_COLUMNS))
+        import pandas as pd
+        sql="SELECT run_id,created,algo,strategy,start,end,bars,elapsed,%s FROM runs" % ','.join(METRICS)
+        cond=[]
+        values=list(args)
+        if where:
+            cond.append('(%s)' % where)
+        for k,v in sorted((params or {}).items()):
+            if isinstance(v,(tuple,list)):
+                cond.append("run_id IN (SELECT run_id FROM params WHERE name=? AND value BETWEEN ? AND ?)")
+                values+=[k,to_value(v[0]),to_value(v[1])]
+            else:
+                cond.append("run_id IN (SELECT run_id FROM params WHERE name=? AND value=?)")
+                values+=[k,to_value(v)]
+        if cond:
+            sql+=" WHERE "+" AND ".join(cond)
+        if order_by:
+            sql+=" ORDER BY %s %s" % (order_by,'ASC' if ascending else 'DESC')
+        if limit:
+            sql+=" LIMIT %d" % int(limit)
+
+        db=self._connect()
+        try:
+            runs=pd.read_sql_query(sql,db,params=values,index_col='run_id')
+            if len(runs)==0:
+                return runs
+            # parameters of the selected runs only, one column each
+            p=pd.read_sql_query("SELECT run_id,name,value FROM params WHERE run_id IN (%s)" %
+                                ','.join(str(x) for x in runs.index),db)
+        finally:
+            db.close()
+        p=p.pivot(index='run_id',columns='name',values='value')
+        return runs.join(p[[x for x in p.columns if x not in runs.columns]])
+
+    def best(self,objective='pnl',**kwargs):
+        """ run_id of the highest objective """
+        runs=self.query(order_by=objective,limit=1,**kwargs)
+        return int(runs.index[0]) if len(runs) else None
+
+    def config(self,run_id):
+        db=self._connect()
+        try:
+            row=db.execute("SELECT config FROM runs WHERE run_id=?",(run_id,)).fetchone()
+        finally:
+            db.close()
+        return json.loads(row[0]) if row else None
+
+    def equity(self,run_id):
+        """ Equity curve of a run as a series indexed by datetime """
+        import pandas as pd
+        equity=load_equity(self.run_path(run_id))
+        return pd.Series(np.array(equity['value']),index=to_datetime(equity['dt']),name='value')
+
+    def trades(self,run_id):
+        """ Closed trades of a run """
+        import pandas as pd
+        df=pd.DataFrame(load_trades(self.run_path(run_id)),columns=['symbol']+TRADE_COLUMNS)
+        df['opened']=to_datetime(df['opened'])
+        df['closed']=to_datetime(df['closed'])
+        df['long']=df['long'].astype(bool)
+        df['bars']=df['bars'].astype(int)
+        return df
+
+def save_arrays(d,equity=None,trades=None):
+    """ Write the EquityCurve and TradeList analyses of a run as columns """
+    if equity:
+        os.makedirs(os.path.join(d,'equity'),exist_ok=True)
+        for x in equity:
+            np.save(os.path.join(d,'equity',x+'.npy'),np.asarray(equity[x],dtype=np.float64))
+    if trades is not None:
+        os.makedirs(os.path.join(d,'trades'),exist_ok=True)
+        for x in TRADE_COLUMNS:
+            np.save(os.path.join(d,'trades',x+'.npy'),np.array([t[x] for t in trades],dtype=np.float64))
+        with open(os.path.join(d,'trades','symbols.json'), 'w') as f:
+            f.write(json.dumps([t['symbol'] for t in trades]))
+
+def load_equity(d):
+    """ Memory-mapped equity columns of save_arrays """
+    d=os.path.join(d,'equity')
+    return {x[:-4]:np.load(os.path.join(d,x),mmap_mode='r') for x in os.listdir(d) if x.endswith('.npy')}
+
+def load_trades(d):
+    """ Trade columns of save_arrays, with the symbols """
+    d=os.path.join(d,'trades')
+    trades={x:np.load(os.path.join(d,x+'.npy')) for x in TRADE_COLUMNS}
+    with open(os.path.join(d,'symbols.json'), 'r') as f:
+        trades['symbol']=json.load(f)
+    return trades
+
+def open_store(config,default_path):
+    """ ResultsStore of the results_store hyperparameter, None if not set """
+    path=config.get('results_store')
+    if not path or path=='false':
+        return None
+    return ResultsStore(default_path if path=='true' else path)
+
+def benchmark(path,count=10000,bars=1000):
+    """ Adds count synthetic runs and times the queries """
+    store=ResultsStore(path)
+    rng=np.random.RandomState(0)
+    dt=np.arange(bars,dtype=np.float64)+735000
+    t=time.time()
+    for i in range(count):
+        config={'algo_name':'algo_bench','fast_period':str(5+i%20),'slow_period':str(50+(i//20)%50*5),'size':'100'}
+        metrics={'trades':int(rng.randint(0,100)),'strike_rate':rng.uniform(0,100),'max_drawdown':rng.uniform(0,20),
+                 'pnl':rng.normal(0,1000),'sqn':rng.normal(0,1),'sharpe_ratio':rng.normal(0,1)}
+        equity={'dt':dt,'value':100000+np.cumsum(rng.normal(0,10,bars))} if i<100 else None
+        store.add(config,metrics,equity)
+    print("[BENCH] added %s runs in %.2fs (%.0f runs/s)" % (count,time.time()-t,count/(time.time()-t)))
+    for name,kwargs in [('top 10 by pnl',{'limit':10}),
+                        ('sharpe>1 and trades>=20',{'where':'sharpe_ratio>1 AND trades>=20','order_by':'sharpe_ratio'}),
+                        ('fast_period=10, slow_period 100..150',{'params':{'fast_period':10,'slow_period':(100,150)}})]:
+        t=time.time()
+        runs=store.query(**kwargs)
+        print("[BENCH] %s: %s runs in %.1fms" % (name,len(runs),(time.time()-t)*1000))
+    t=time.time()
+    store.equity(1)
+    print("[BENCH] equity of %s bars in %.1fms" % (bars,(time.time()-t)*1000))
+
+if __name__ == '__main__':
+    import sys
+    if len(sys.argv)>1 and sys.argv[1]=='bench':
+        import shutil
+        import tempfile
+        path=tempfile.mkdtemp(prefix='results')
+        try:
+            benchmark(path)
+        finally:
+            shutil.rmtree(path,ignore_errors=True)
+    else:
+        store=ResultsStore(sys.argv[1])
+        print(store.query(order_by=sys.argv[2] if len(sys.argv)>2 else 'pnl',
+                          where=sys.argv[3] if len(sys.argv)>3 else None,limit=20).to_string())
@@ -0,0 +1,127 @@
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from algo_base import AlgoStrategy, StrategyTemplate
+from algo_columnar_feed import AlgoColumnarData, write_columnar
+
+# Parameter sweep: run one strategy for every combination of parameter
+# ranges in a process pool, on data that is parsed once and memory-mapped
+# by the workers, and collect the metrics of all runs in one table.
+#
+# hyperparameters.json: "sweep": {"fast_period":[5,10,20],"slow_period":"20:60:10"}
+# (as a JSON string when passed as a SageMaker hyperparameter)
+
+METRICS = ['pnl','sharpe_ratio','max_drawdown','sqn','trades','strike_rate']
+
+# set once per worker process by _init_worker
+_strategy=None
+_config=None
+_path=None
+
+def parse_range(value):
+    """ Values of a range: a list, a scalar, or "start:stop[:step]" with stop included """
+    if isinstance(value,list):
+        return value
+    if isinstance(value,str) and ':' in value:
+        parts=[float(x) for x in value.split(':')]
+        start,stop=parts[0],parts[1]
+        step=parts[2] if len(parts)>2 else 1
+        values=np.arange(start,stop+step/2.0,step)
+        if all(x==int(x) for x in parts):
+            return [int(x) for x in values]
+        return [round(float(x),10) for x in values]
+    return [value]
+
+def parse_ranges(sweep):
+    """ Parameter ranges of the sweep config, a dict or its JSON string """
+    if isinstance(sweep,str):
+        sweep=json.loads(sweep)
+    return {k:parse_range(v) for k,v in sweep.items()}
+
+def grid(ranges):
+    """ Every combination of the ranges, as parameter dicts """
+    names=sorted(ranges)
+    return [dict(zip(names,values)) for values in itertools.product(*[ranges[x] for x in names])]
+
+def _init_worker(strategy,config,path,quiet):
+    global _strategy,_config,_path
+    if quiet:
+        sys.stdout=open(os.devnull, 'w')
+    _strategy=strategy
+    _config=config
+    _path=path
+
+def _run(i_params):
+    i,params=i_params
+    config=dict(_config)
+    config.update(params)
+    algo=AlgoStrategy(config,_strategy,AlgoColumnarData(_path))
+    algo.run()
+    m=algo.metrics()
+    m.update(params)
+    m['run']=i
+    return m
+
+def run_sweep(config,strategy,datafile,ranges,workers=None,quiet=True):
+    """ Run a strategy for every combination of the parameter ranges
+    Args:
+        config: hyperparameters, the swept ones are overridden per run
+        strategy: StrategyTemplate subclass
+        datafile: daily csv, parsed once for all runs
+        ranges: {parameter:[values]}
+        workers: number of processes, cpu count if None
+        quiet: silence the per-bar output of the runs
+    Returns:
+        results: frame with the parameters and metrics of every run
+    """
+    combos=grid(ranges)
+    print("[SWEEP] %s combinations of %s" % (len(combos),', '.join(sorted(ranges))))
+
+    # the runs only report metrics
+    config=dict(config)
+    config.pop('sweep',None)
+    config['chart']='false'
+    config.pop('submitUrl',None)
+
+    path=tempfile.mkdtemp(prefix='sweep')
+    try:
+        t=time.time()
+        write_columnar(datafile,path)
+        print("[SWEEP] data loaded in %.3fs" % (time.time()-t))
+
+        if workers is None:
+            workers=multiprocessing.cpu_count()
+        t=time.time()
+        pool=multiprocessing.Pool(workers,initializer=_init_worker,initargs=(strategy,config,path,quiet))
+        try:
+            rows=pool.map(_run,list(enumerate(combos)))
+        finally:
+            pool.close()
+            pool.join()
+        elapsed=time.time()-t
+    finally:
+        shutil.rmtree(path,ignore_errors=True)
+    print("[SWEEP] ran %s combinations with %s workers in %.3fs (%.2f runs/s)" % (len(combos),workers,elapsed,len(combos)/elapsed))
+
+    results=pd.DataFrame(rows).set_index('run').sort_index()
+    return results[sorted(ranges)+METRICS]
+
+def save(results,path=StrategyTemplate.MODEL_PATH,objective='pnl'):
+    """ Write sweep.csv ranked by objective and print the best run """
+    ranked=results.sort_values(objective,ascending=False)
+    ranked.to_csv(os.path.join(path,'sweep.csv'))
+    print(ranked.head(10).to_string())
+    best=ranked.iloc[0]
+    params={k:ranked[k].iloc[0] for k in ranked.columns if k not in METRICS}
+    print('[BEST %s]' % json.dumps({k:v.item() if hasattr(v,'item') else v for k,v in params.items()}))
+    print('[SQN:%.2f, Sharpe Ratio:%.2f, Total PnL:%.2f]' % (best['sqn'],best['sharpe_ratio'],best['pnl']))
+    return ranked
@@ -0,0 +1,131 @@
+import contextlib
+import io
+import json
+import os
+import time
+
+import backtrader as bt
+import pandas as pd
+
+# In-process stand-in for the algo_market_data Lambda function, so the live
+# feed can be tested and benchmarked offline:
+#   AlgoLiveData(None,client=LocalMarketData.from_csv('data.csv'))
+#
+#   python local_market_data.py data.csv [bars]   bars/s with and without the cursor
+#   python local_market_data.py ticks             bars built from ticks sharing timestamps
+
+class LocalMarketData(object):
+    """ Serves the rows of a price history as live bars
+    Every invoke releases rate more bars to simulate a growing feed.
+    Args:
+        bars: list of {'date','close'} dicts in time order
+        rate: bars released per invoke
+        full_payload: ignore the 'since' cursor and return every bar
+            released so far, like the deployed function
+        replay: number of already delivered bars sent again per invoke,
+            to simulate at-least-once delivery
+    """
+    def __init__(self,bars,rate=1,full_payload=False,replay=0):
+        self.bars=bars
+        self.keys=[pd.to_datetime(x['date']) for x in bars]
+        self.rate=rate
+        self.full_payload=full_payload
+        self.replay=replay
+        self.released=0
+        self.invocations=0
+        self.bytes=0
+
+    @staticmethod
+    def from_csv(datafile,count=None,**kwargs):
+        df=pd.read_csv(datafile,nrows=count)
+        bars=[{'date':d,'close':float(c)} for d,c in zip(df['dt'],df['close'])]
+        return LocalMarketData(bars,**kwargs)
+
+    def exhausted(self):
+        return self.released>=len(self.bars)
+
+    def invoke(self,FunctionName,InvocationType,Payload):
+        req=json.loads(Payload)
+        self.invocations+=1
+        start=self.released
+        self.released=min(len(self.bars),self.released+self.rate)
+
+        first=0
+        if 'since' in req and not self.full_payload:
+            since=pd.to_datetime(req['since'])
+            first=start
+            while first>0 and self.keys[first-1]>since:
+                first-=1
+        first=max(0,first-self.replay)
+
+        body=json.dumps(self.bars[first:self.released]).encode('utf-8')
+        self.bytes+=len(body)
+        return {'StatusCode':200,'Payload':io.BytesIO(body)}
+
+def benchmark(datafile,count=None):
+    """ Bars/second and payload bytes of the live feed against the stand-in,
+    with the whole payload on every call versus only bars after the cursor
+    """
+    from algo_live_feed import AlgoLiveData
+
+    class Consume(bt.Strategy):
+        params=(('count',0),)
+        def next(self):
+            if len(self)>=self.p.count:
+                self.env.runstop()
+
+    res={}
+    for name,full in [('full',True),('cursor',False)]:
+        stub=LocalMarketData.from_csv(datafile,count,full_payload=full,replay=1)
+        n=len(stub.bars)
+        data=AlgoLiveData(None,client=stub,poll_interval=0)
+        cerebro=bt.Cerebro()
+        cerebro.adddata(data)
+        cerebro.addstrategy(Consume,count=n)
+        t=time.time()
+        with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+            strat=cerebro.run()[0]
+        elapsed=time.time()-t
+        res[name]=n/elapsed
+        print("[BENCH] %s: %s bars delivered, %s duplicates dropped, %s invokes, %.0f payload bytes/invoke, %.0f bars/s" %
+              (name,len(strat),data.stats['duplicates'],stub.invocations,stub.bytes/stub.invocations,n/elapsed))
+    return res
+
+# ticks with several at one timestamp, for tick_check
+TICKS = [('2020-01-02 09:30:00',10.0,100),('2020-01-02 09:30:00',12.0,200),('2020-01-02 09:30:00',8.0,300),
+         ('2020-01-02 09:30:30',11.0,100),('2020-01-02 09:31:00',9.0,100),('2020-01-02 09:31:00',13.0,100),
+         ('2020-01-02 09:31:10',12.0,100),('2020-01-02 09:31:10',12.5,100),('2020-01-02 09:31:10',11.5,100),
+         ('2020-01-02 09:32:05',10.0,100)]
+
+def tick_check(intervals=('1m',),rate=2,replay=1):
+    """ Bars the live feed builds from TICKS, delivered rate ticks per
+    invoke with replays, against the aggregator fed the ticks directly
+    Returns:
+        ok: True if every completed bar agrees
+    """
+    from algo_bar_aggregator import BarAggregator
+    from algo_live_feed import AlgoLiveData
+    ticks=[{'date':d,'price':p,'volume':v} for d,p,v in TICKS]
+    ref=BarAggregator(intervals)
+    for x in ticks:
+        ref.add_tick(x['date'],x['price'],x['volume'])
+    stub=LocalMarketData(ticks,rate=rate,replay=replay)
+    data=AlgoLiveData(None,client=stub,poll_interval=0,intervals=intervals)
+    while not stub.exhausted():
+        for x in data.fetch():
+            data._add_tick(x)
+    ok=data.aggregator.ticks==len(ticks)
+    for x in ref.intervals:
+        a=ref.rings[x].last(len(ref.rings[x]))
+        b=data.aggregator.rings[x].last(len(data.aggregator.rings[x]))
+        same=a.shape==b.shape and bool((a==b).all())
+        ok=ok and same
+        print("[TICKS] %ss: %s bars, %s" % (x,len(b),'ok' if same else 'MISMATCH expected %s got %s' % (a.tolist(),b.tolist())))
+    print("[TICKS] %s of %s ticks kept, %s duplicates dropped" % (data.aggregator.ticks,len(ticks),data.stats['duplicates']))
+    return ok
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1]=='ticks':
+        sys.exit(0 if tick_check() else 1)
+    benchmark(sys.argv[1],int(sys.argv[2]) if len(sys.argv)>2 else None)
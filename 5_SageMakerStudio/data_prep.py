@@ -1,12 +1,24 @@
 import h5py
+import argparse
 import datetime
+import json
+import multiprocessing
+import numpy as np
 import pandas as pd
-import sys
+import os
+import shutil
+import tempfile
+import time
+
+from trading_calendar import default_calendar
 
 START_DATE = '2012-08-13'
 END_DATE = '2017-08-11'
 DATE_FORMAT = '%Y-%m-%d'
 START_DATETIME = datetime.datetime.strptime(START_DATE, DATE_FORMAT)
+FIELDS = ['open','high','low','close','vol']
+# day number of 1970-01-01 in backtrader's date2num convention
+EPOCH_ORDINAL = 719163
 
 def read_stock_history(filepath):
     """ Read data from extracted h5
@@ -22,10 +34,85 @@ def read_stock_history(filepath):
         abbreviation = [abbr.decode('utf-8') for abbr in abbreviation]
     return history, abbreviation
 
+class StockHistory(object):
+    """ Lazy reader of the extracted h5
+    Keeps the file open and slices only the requested symbols and date
+    range from the dataset instead of loading the whole universe.
+    The rows are calendar days with weekends and holidays carrying the
+    previous session forward, sessions_only drops those rows.
+    Args:
+        filepath: path of file
+        sessions_only: only return rows of trading sessions
+    """
+    def __init__(self,filepath,sessions_only=False):
+        self.f=h5py.File(filepath, 'r')
+        self.history=self.f['history']
+        self.abbreviation=[abbr.decode('utf-8') for abbr in self.f['abbreviation'][:].tolist()]
+        self.index={stk:p for p,stk in enumerate(self.abbreviation)}
+        self.days=self.history.shape[1]
+        self.dates=date_index(self.days)
+        self.sessions=None
+        if sessions_only:
+            self.sessions=default_calendar().is_session(self.dates.values)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def day_range(self,start=None,end=None):
+        """ Convert an inclusive date range to a slice of day positions """
+        i0=0
+        i1=self.days
+        if start is not None:
+            i0=min(self.days,max(0,(pd.Timestamp(start)-START_DATETIME).days))
+        if end is not None:
+            i1=min(self.days,max(i0,(pd.Timestamp(end)-START_DATETIME).days+1))
+        return slice(i0,i1)
+
+    def read(self,stk,start=None,end=None):
+        """ Read one symbol
+        Returns:
+            dates: date index of the rows
+            h: array of shape (day, field)
+        """
+        r=self.day_range(start,end)
+        dates,h=self.dates[r],self.history[self.index[stk],r,:]
+        if self.sessions is not None:
+            m=self.sessions[r]
+            dates,h=dates[m],h[m]
+        return dates,h
+
+    def read_many(self,symbols,start=None,end=None):
+        """ Read several symbols with one selection on the dataset
+        Returns:
+            dates: date index of the rows
+            h: array of shape (symbol, day, field) in the order of symbols
+        """
+        r=self.day_range(start,end)
+        pos=[self.index[stk] for stk in symbols]
+        rows=sorted(set(pos))
+        h=self.history[rows,r,:][[rows.index(p) for p in pos]]
+        dates=self.dates[r]
+        if self.sessions is not None:
+            m=self.sessions[r]
+            dates,h=dates[m],h[:,m]
+        return dates,h
+
 def index_to_date(index):
     return (START_DATETIME + datetime.timedelta(index)).strftime(DATE_FORMAT)
 
-def save_stock_data(stk,history,abbreviation):
+def date_index(count):
+    """ Build the date index for the first count days of the history once,
+    instead of formatting one date per row
+    """
+    return pd.date_range(start=START_DATETIME, periods=count, freq='D', name='dt')
+
+def save_stock_data(stk,history,abbreviation,path=""):
     p=abbreviation.index(stk)
     h=history[p]
     tData=[]
@@ -37,14 +124,226 @@ def save_stock_data(stk,history,abbreviation):
         v=h[x]
         for y in range(0,len(v)):
             row.append(v[y])
-        tData.append(row)    
+        tData.append(row)
     df=pd.DataFrame(tData,columns=hData)
     df.set_index(pd.DatetimeIndex(df['dt']), inplace=True)
     del df['dt']
-    df.to_csv(stk+".csv")
+    df.to_csv(os.path.join(path,stk+".csv"))
     print("store:"+stk)
     return df
 
-stk=sys.argv[1]
-history,abbreviation=read_stock_history('stocks_history_target.h5')
-save_stock_data(stk,history,abbreviation)
\ No newline at end of file
+def stock_frame(stk,h,dates):
+    """ Convert the (day, field) array of one symbol to a DataFrame
+    Args:
+        stk: symbol
+        h: array of shape (day, field)
+        dates: date index of the rows
+    Returns:
+        df: frame with the same layout as save_stock_data
+    """
+    df=pd.DataFrame(h,index=dates,columns=FIELDS)
+    df.insert(0,'sym',stk)
+    return df
+
+def write_stock_csv(reader,stk,path,start=None,end=None):
+    """ Export one symbol to <path>/<stk>.csv
+    Returns:
+        rows: number of rows written
+    """
+    dates,h=reader.read(stk,start,end)
+    stock_frame(stk,h,dates).to_csv(os.path.join(path,stk+".csv"))
+    return h.shape[0]
+
+def write_stock_columnar(reader,stk,path,start=None,end=None):
+    """ Export one symbol to <path>/<stk>/<column>.npy
+    Returns:
+        entry: index.json entry of the symbol
+    """
+    dates,h=reader.read(stk,start,end)
+    dt=(dates.values.astype('datetime64[D]').astype(np.int64)+EPOCH_ORDINAL).astype(np.float64)
+    d=os.path.join(path,stk)
+    os.makedirs(d,exist_ok=True)
+    np.save(os.path.join(d,'dt.npy'),dt)
+    for y,field in enumerate(FIELDS):
+        np.save(os.path.join(d,field+'.npy'),np.ascontiguousarray(h[:,y],dtype=np.float64))
+    return {'count':int(h.shape[0]),
+            'start':dates[0].strftime(DATE_FORMAT) if len(dates) else None,
+            'end':dates[-1].strftime(DATE_FORMAT) if len(dates) else None}
+
+def update_columnar_index(path,entries):
+    """ Merge symbol entries into <path>/index.json """
+    indexFile=os.path.join(path,'index.json')
+    index={'columns':['dt']+FIELDS,'symbols':{}}
+    if os.path.exists(indexFile):
+        with open(indexFile, 'r') as f:
+            index = json.load(f)
+    index['symbols'].update(entries)
+    with open(indexFile, 'w') as f:
+        f.write(json.dumps(index))
+    return index
+
+def save_stock_data_bulk(reader,symbols=None,path="",start=None,end=None):
+    """ Export many symbols from one open h5 file
+    Args:
+        reader: StockHistory
+        symbols: symbols to export, all if None
+        path: output directory
+        start: first date to export, inclusive
+        end: last date to export, inclusive
+    Returns:
+        files: list of written csv files
+    """
+    if symbols is None:
+        symbols=reader.abbreviation
+    files=[]
+    for stk in symbols:
+        write_stock_csv(reader,stk,path,start,end)
+        files.append(os.path.join(path,stk+".csv"))
+        print("store:"+stk)
+    return files
+
+def save_stock_columnar(reader,symbols=None,path="columnar",start=None,end=None):
+    """ Export symbols as a columnar store for AlgoColumnarData
+    Each symbol gets a directory with one float64 .npy file per column
+    (dt,open,high,low,close,vol), dt holding backtrader day numbers, and
+    index.json lists the symbols with their row count and date range.
+    Args:
+        reader: StockHistory
+        symbols: symbols to export, all if None
+        path: root directory of the store
+        start: first date to export, inclusive
+        end: last date to export, inclusive
+    Returns:
+        index: content of index.json
+    """
+    if symbols is None:
+        symbols=reader.abbreviation
+    entries={}
+    for stk in symbols:
+        entries[stk]=write_stock_columnar(reader,stk,path,start,end)
+        print("store:"+stk)
+    return update_columnar_index(path,entries)
+
+# one reader per worker process, h5py handles can't be shared across processes
+_reader=None
+
+def _init_worker(filepath,sessions_only=False):
+    global _reader
+    _reader=StockHistory(filepath,sessions_only)
+
+def _export(args):
+    stk,fmt,path,start,end=args
+    t=time.time()
+    if fmt=='columnar':
+        entry=write_stock_columnar(_reader,stk,path,start,end)
+        rows=entry['count']
+    else:
+        entry=None
+        rows=write_stock_csv(_reader,stk,path,start,end)
+    return stk,rows,time.time()-t,entry
+
+def export_parallel(filepath,symbols=None,fmt='csv',path="",start=None,end=None,workers=None,sessions_only=False):
+    """ Fan the per-symbol export out over a process pool
+    Args:
+        filepath: path of the h5 file
+        symbols: symbols to export, all if None
+        fmt: 'csv' or 'columnar'
+        path: output directory
+        start: first date to export, inclusive
+        end: last date to export, inclusive
+        workers: number of processes, cpu count if None
+        sessions_only: drop rows of days that are not trading sessions
+    Returns:
+        stats: list of (symbol, rows, seconds)
+    """
+    if symbols is None:
+        with StockHistory(filepath) as reader:
+            symbols=reader.abbreviation
+    if workers is None:
+        workers=multiprocessing.cpu_count()
+    workers=max(1,min(workers,len(symbols)))
+    if path:
+        os.makedirs(path,exist_ok=True)
+
+    tasks=[(stk,fmt,path,start,end) for stk in symbols]
+    stats=[]
+    entries={}
+    t=time.time()
+    pool=None
+    if workers==1:
+        _init_worker(filepath,sessions_only)
+        results=map(_export,tasks)
+    else:
+        pool=multiprocessing.Pool(workers,initializer=_init_worker,initargs=(filepath,sessions_only))
+        results=pool.imap_unordered(_export,tasks)
+    try:
+        for stk,rows,secs,entry in results:
+            print("store:%s,rows=%s,time=%.3fs" % (stk,rows,secs))
+            stats.append((stk,rows,secs))
+            if entry is not None:
+                entries[stk]=entry
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    if fmt=='columnar':
+        update_columnar_index(path,entries)
+    elapsed=time.time()-t
+    rows=sum(x[1] for x in stats)
+    print("[EXPORT] symbols=%s, rows=%s, workers=%s, time=%.3fs, %.1f symbols/s, %.0f rows/s" % (len(stats),rows,workers,elapsed,len(stats)/elapsed,rows/elapsed))
+    return stats
+
+def benchmark(filepath,symbols=None,path=""):
+    """ Compare the per-row export with the bulk export """
+    history,abbreviation=read_stock_history(filepath)
+    if symbols is None:
+        symbols=abbreviation
+    t=time.time()
+    for stk in symbols:
+        save_stock_data(stk,history,abbreviation,path)
+    rowTime=time.time()-t
+    t=time.time()
+    with StockHistory(filepath) as reader:
+        save_stock_data_bulk(reader,symbols,path)
+    bulkTime=time.time()-t
+    print("[BENCH] symbols=%s, per-row=%.3fs, bulk=%.3fs, speedup=%.1fx" % (len(symbols),rowTime,bulkTime,rowTime/bulkTime))
+    return rowTime,bulkTime
+
+def read_symbols(args):
+    """ Resolve the symbols given on the command line, None means all """
+    symbols=list(args.symbols)
+    if args.symbols_file:
+        with open(args.symbols_file, 'r') as f:
+            symbols+=[x.strip() for x in f.read().replace(',','\n').split('\n') if x.strip()]
+    if not symbols or 'all' in symbols:
+        return None
+    return symbols
+
+if __name__ == '__main__':
+    parser=argparse.ArgumentParser(description='Export symbols from the h5 stock history')
+    parser.add_argument('symbols',nargs='*',help="symbols to export or 'all'")
+    parser.add_argument('--symbols-file',help='file with one symbol per line')
+    parser.add_argument('--start',help='first date to export, YYYY-MM-DD')
+    parser.add_argument('--end',help='last date to export, YYYY-MM-DD')
+    parser.add_argument('--format',default='csv',choices=['csv','columnar'])
+    parser.add_argument('--out',help='output directory')
+    parser.add_argument('--workers',type=int,help='number of processes, default cpu count')
+    parser.add_argument('--sessions-only',action='store_true',help='drop weekend and holiday rows')
+    parser.add_argument('--h5',default='stocks_history_target.h5',help='path of the h5 file')
+    parser.add_argument('--bench',action='store_true',help='compare the per-row and bulk export')
+    args=parser.parse_args()
+
+    symbols=read_symbols(args)
+    if args.bench:
+        # without --out the files go to a temporary directory, not over the data
+        path=args.out or tempfile.mkdtemp(prefix='data_prep_bench')
+        try:
+            benchmark(args.h5,symbols,path)
+        finally:
+            if args.out is None:
+                shutil.rmtree(path,ignore_errors=True)
+    else:
+        path=args.out
+        if path is None:
+            path="columnar" if args.format=='columnar' else ""
+        export_parallel(args.h5,symbols,args.format,path,args.start,args.end,args.workers,args.sessions_only)